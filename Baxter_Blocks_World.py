@@ -91,7 +91,50 @@ def moveb_m(state, goal):
             continue
     return []
 
-    
+
+
+def moveb_alternatives(state, goal):
+    """
+    Like moveb_m, but offers a move for every misplaced block that can move
+    now instead of only the first one, so best-first search can choose the
+    order.
+    """
+    choices = Alternatives()
+    for b in state.pos:
+        if state.pos[b] == goal.pos[b]:
+            continue
+        elif goal.pos[b] == 'center' and state.pos[b] == 't1':
+            choices.append([('move_one', ''+b, 'center', 'left'), ('move_blocks', goal)])
+        elif goal.pos[b] == 'center' and state.pos[b] == 't2':
+            choices.append([('move_one', ''+b, 'center', 'right'), ('move_blocks', goal)])
+        elif goal.pos[b] == 't1' and state.pos[b] == 't2':
+            choices.append([('move_one', ''+b, 'center', 'right'), ('move_blocks', goal)])
+        elif goal.pos[b] == 't2' and state.pos[b] == 't1':
+            choices.append([('move_one', ''+b, 'center', 'left'), ('move_blocks', goal)])
+        elif goal.pos[b] == 't1' and state.pos[b] == 'center' and state.delete['t1']:
+            choices.append([('move_one', ''+b, 't1', 'left'), ('move_blocks', goal)])
+        elif goal.pos[b] == 't2' and state.pos[b] == 'center'and state.delete['t2']:
+            choices.append([('move_one', ''+b, 't2', 'right'), ('move_blocks', goal)])
+    if not choices:
+        return []
+    return choices
+
+
+def blocks_out_of_place(state, tasks):
+    """
+    Heuristic for best-first search: every block that is not at its goal
+    position needs a pickup and a place (only a place if it is already in
+    a hand). Never overestimates, so shortest plans stay shortest.
+    """
+    goal = find_if(lambda t: t[0] == 'move_blocks', tasks)
+    if goal is None:
+        return 0
+    goal = goal[1]
+    steps = 0
+    for b in state.pos:
+        if state.pos[b] != goal.pos[b]:
+            steps += 1 if state.pos[b] in ('left', 'right') else 2
+    return steps
 
 
 # methods for "move_one"
@@ -120,6 +163,20 @@ def put_m(state, b, dest, hand):
     else:
         return False
 
+def make_domain(alternatives=False):
+    """
+    Builds the Baxter World domain once so that many planners can share it.
+    With alternatives, move_blocks offers every possible next move (for
+    best-first and anytime search) instead of only the first one.
+    """
+    domain = Domain("Baxter_World")
+    domain.declare_operators(place, pickup)
+    domain.declare_methods('put', put_m)
+    domain.declare_methods('get', get_m)
+    domain.declare_methods('move_one', move1)
+    domain.declare_methods('move_blocks', moveb_alternatives if alternatives else moveb_m)
+    return domain
+
 def formulate_problem():
     """ 
     The variable sstate has already been initialized and sstate.holding has been set.
@@ -153,6 +210,7 @@ def main(argv):
     parser = argparse.ArgumentParser(description='HTN Planner')
     parser.add_argument('-r', action='store_true', help='Use ROS')
     parser.add_argument('-f', action='store_true', help='Tests for grading)')
+    parser.add_argument('-s', action='store_true', help='Print a two-arm schedule of the plan')
     args = parser.parse_args()
     if args.f:
         file_input(argv)
@@ -164,16 +222,18 @@ def main(argv):
     HTNplanner.declare_methods('get', get_m)
     HTNplanner.declare_methods('move_one', move1)
     HTNplanner.declare_methods('move_blocks', moveb_m)
-    HTNplanner.planner(state, [('move_blocks', goal)])
-    plan = [p for p in HTNplanner.planningsteps.items() if p[1][0] == 'operator'] 
+    plan = HTNplanner.planner(state, [('move_blocks', goal)]) or []
     num = []
     actions = []
     print("HTN Actions:")
     for cnt, elem in enumerate(plan):
-        print("%s.  %s " % (cnt + 1, elem[1][1]))
+        print("%s.  %s " % (cnt + 1, elem))
         num.append(cnt+1)
-        p = ' '.join(map(str,elem[1][1]))
+        p = ' '.join(map(str,elem))
         actions.append(p)
+    if args.s:
+        from scheduler import schedule
+        print(schedule(state, plan).format())
     if args.r:
         rospy.init_node('Planner', anonymous=True)
         pub_plan = rospy.Publisher('/plan', Plan, queue_size=100)
@@ -181,7 +241,7 @@ def main(argv):
         for cnt, elem in enumerate(plan):
             s = Step()
             s.num.data = cnt+1
-            s.step.data = ' '.join(map(str,elem[1][1]))
+            s.step.data = ' '.join(map(str,elem))
             p.plan.append(s)
         rospy.sleep(1)
         pub_plan.publish(p)
@@ -1,7 +1,13 @@
 from __future__ import print_function
 import copy
+import heapq
+import itertools
 import sys
 import pprint
+import timeit
+from collections import OrderedDict
+
+from instrumentation import clock
 
 
 class State():
@@ -19,6 +25,168 @@ class Goal():
     def __init__(self, name):
         self.__name__ = name
 
+# Journaled states
+#
+# Instead of deep-copying the whole state before every operator, the planner
+# lets operators write straight into an UndoState. Every attribute write and
+# every item write on a dict attribute appends (container, key, old value) to
+# a shared undo log, so backtracking only restores what actually changed.
+
+
+_MISSING = object()
+
+
+def _undo(log, mark):
+    while len(log) > mark:
+        container, key, old = log.pop()
+        if old is _MISSING:
+            dict.__delitem__(container, key)
+        else:
+            dict.__setitem__(container, key, old)
+
+
+class TrackedDict(dict):
+
+    """A dict that records every write in an undo log."""
+
+    __slots__ = ('_log',)
+
+    def __init__(self, items, log):
+        dict.__init__(self, items)
+        self._log = log
+
+    def __setitem__(self, key, value):
+        self._log.append((self, key, self.get(key, _MISSING)))
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._log.append((self, key, self[key]))
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(iter(self))
+        return key, self.pop(key)
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def __copy__(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))                # A copy outside its state has no log to write to
+
+
+class UndoState(State):
+
+    """A state whose writes can be rolled back to an earlier checkpoint.
+
+    Attributes holding dicts are wrapped in TrackedDict, so operators that
+    do state.pos[b] = x or state.holdingL = b work unchanged. Values nested
+    deeper than one dict level are not journaled; use the 'copy' state mode
+    for domains that mutate those in place.
+    """
+
+    __slots__ = ('_log',)
+
+    def __init__(self, name):
+        object.__setattr__(self, '_log', [])
+        State.__init__(self, name)
+
+    @classmethod
+    def from_state(cls, state):
+        """Returns a journaled copy of state; state itself is left untouched."""
+        new = cls(getattr(state, '__name__', 'state'))
+        for name, value in vars(copy.deepcopy(state)).items():
+            setattr(new, name, value)
+        del new._log[:]
+        return new
+
+    def __setattr__(self, name, value):
+        d = self.__dict__
+        self._log.append((d, name, d.get(name, _MISSING)))
+        if type(value) is dict:
+            value = TrackedDict(value, self._log)
+        d[name] = value
+
+    def __delattr__(self, name):
+        d = self.__dict__
+        self._log.append((d, name, d[name]))
+        del d[name]
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        attrs = dict((name, dict(value) if isinstance(value, dict) else value)
+                     for name, value in self.__dict__.items() if name != '__name__')
+        return (_rebuild_undo_state, (self.__class__, self.__name__, attrs))
+
+    def checkpoint(self):
+        """Returns a mark that rollback() can restore the state to."""
+        return len(self._log)
+
+    def rollback(self, mark):
+        """Undoes every write made since checkpoint() returned mark."""
+        _undo(self._log, mark)
+
+    def commit(self):
+        """Makes every write so far permanent by emptying the undo log.
+        Marks returned by earlier checkpoint() calls become invalid."""
+        del self._log[:]
+
+    def copy(self):
+        """Returns an independent journaled copy with an empty log."""
+        new = UndoState(self.__name__)
+        for name, value in self.__dict__.items():
+            if isinstance(value, dict):
+                value = copy.deepcopy(dict(value))
+            else:
+                value = copy.deepcopy(value)
+            setattr(new, name, value)
+        del new._log[:]
+        return new
+
+
+def _rebuild_undo_state(cls, name, attrs):
+    state = cls(name)
+    for attr, value in attrs.items():
+        setattr(state, attr, value)
+    del state._log[:]
+    return state
+
+
+def journaled(state):
+    """Returns state itself if it supports checkpoint/rollback, else a
+    journaled copy of it."""
+    if hasattr(state, 'checkpoint') and hasattr(state, 'rollback'):
+        return state
+    return UndoState.from_state(state)
+
 # Helper Function
 
 
@@ -47,54 +215,590 @@ def find_all(cond, seq):
     else:
         return None
 
-# Main planning class
+def freeze(value, cache=None):
+    """
+    Returns a hashable canonical form of value: dicts become frozensets of
+    items, lists and tuples become tuples, and plain objects become their
+    class name plus their frozen attributes. Objects that know their own
+    canonical form (such as compact states) provide it through frozen().
+    cache maps id(obj) to the frozen form of objects that are known not to
+    change during a search.
+    """
+    if hasattr(value, 'frozen'):
+        return value.frozen()
+    if isinstance(value, dict):
+        return frozenset((k, freeze(v, cache)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v, cache) for v in value)
+    if hasattr(value, '__dict__') and type(value).__hash__ is object.__hash__:
+        if cache is not None and id(value) in cache:
+            return cache[id(value)]
+        frozen = (value.__class__.__name__, freeze(vars(value)))
+        if cache is not None:
+            cache[id(value)] = frozen
+        return frozen
+    return value
 
 
-class HTNPlanner():
-    operators = {}
-    methods = {}
-    planningsteps = dict()
-    result = []
+class TranspositionTable():
 
-    def __init__(self, name):
+    """Bounded LRU table of (state, tasks) keys already proved unsolvable.
+
+    Each entry keeps the largest remaining depth budget the key failed with
+    (None for unbounded), so a hit is only reported when the new attempt has
+    no more budget than the failed one.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def failed(self, key, budget):
+        failed_budget = self.entries.get(key, _MISSING)
+        if failed_budget is not _MISSING and (failed_budget is None or
+                                              (budget is not None and budget <= failed_budget)):
+            self.hits += 1
+            del self.entries[key]
+            self.entries[key] = failed_budget
+            return True
+        self.misses += 1
+        return False
+
+    def record(self, key, budget):
+        failed_budget = self.entries.pop(key, _MISSING)
+        if failed_budget is not _MISSING and budget is not None and (
+                failed_budget is None or failed_budget > budget):
+            budget = failed_budget
+        self.entries[key] = budget
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries), 'maxsize': self.maxsize}
+
+class Alternatives(list):
+
+    """Returned by a method to offer several decompositions of one task.
+
+    Each element is a subtask list; the planner tries them as separate
+    branches, in order for depth-first search and by heuristic value for
+    best-first search.
+    """
+
+
+def _decompositions(subtasks):
+    if isinstance(subtasks, Alternatives):
+        return subtasks
+    return (subtasks,)
+
+
+def _clone(state, stats=None):
+    if stats is not None:
+        stats.state_copies += 1
+    if hasattr(state, 'copy'):
+        return state.copy()
+    return copy.deepcopy(state)
+
+
+def _unwind(plan):
+    steps = []
+    while plan is not None:
+        task, plan = plan
+        steps.append(task)
+    steps.reverse()
+    return steps
+
+
+def zero_heuristic(state, tasks):
+    return 0
+
+# Plans
+
+
+class TaskNode():
+
+    """A task in a decomposition tree.
+
+    method is the name of the method that decomposed the task, or None if
+    the task is an operator step; children are its subtasks in order.
+    """
+
+    def __init__(self, task, method=None):
+        self.task = task
+        self.method = method
+        self.children = []
+
+    def __repr__(self):
+        if self.method is None:
+            return 'TaskNode(%r)' % (self.task,)
+        return 'TaskNode(%r, %r, %r)' % (self.task, self.method, self.children)
+
+
+class Solution(list):
+
+    """The operator steps of a plan, in execution order.
+
+    tree is the decomposition tree, one TaskNode per top-level task, if the
+    planner was built with record_tree=True, and None otherwise.
+    """
+
+    def __init__(self, steps=(), tree=None):
+        list.__init__(self, steps)
+        self.tree = tree
+
+
+def _build_tree(entries, roots):
+    # Entries are (method name or None, task, number of subtasks) in the
+    # order search committed to them, which is a pre-order walk of the tree.
+    forest = []
+    stack = [[forest, roots]]
+    for method, task, arity in entries:
+        while stack[-1][1] == 0:
+            stack.pop()
+        parent = stack[-1]
+        node = TaskNode(task, method)
+        parent[0].append(node)
+        parent[1] -= 1
+        if arity:
+            stack.append([node.children, arity])
+    return forest
+
+# Planning domain
+
+
+class Domain():
+
+    """Operators and methods of a planning domain.
+
+    A domain is built once and can be shared read-only by any number of
+    HTNPlanner instances. dispatch maps each task name straight to its
+    (operator, methods) pair so the planner resolves a task with a single
+    lookup. Domains whose methods depend on anything but their arguments
+    and the state should be built with pure=False, which turns off failure
+    memoization for them.
+    """
+
+    def __init__(self, name, pure=True):
         self.__name__ = name
+        self.pure = pure
+        self.operators = {}
+        self.methods = {}
+        self.dispatch = {}
 
     def declare_operators(self, *op_list):
         self.operators.update({op.__name__: op for op in op_list})
+        for op in op_list:
+            self._resolve(op.__name__)
         return self.operators
 
     def declare_methods(self, task_name, *method_list):
         self.methods.update({task_name: list(method_list)})
+        self._resolve(task_name)
         return self.methods[task_name]
 
+    def _resolve(self, task_name):
+        self.dispatch[task_name] = (self.operators.get(task_name),
+                                    tuple(self.methods.get(task_name, ())))
+
+# Main planning class
+
+
+class HTNPlanner():
+
+    """A planner over a Domain. Each instance keeps its own trace and result."""
+
+    def __init__(self, name, domain=None, state_mode='undo', engine='recursive', max_depth=50,
+                 memo_size=None, heuristic=zero_heuristic, weight=1.0, stats=None,
+                 record_tree=False):
+        """
+        domain is a shared Domain; if omitted the planner gets a private one
+        filled in through declare_operators and declare_methods.
+        state_mode is 'undo' (operators write into a journaled state that is
+        rolled back on backtracking) or 'copy' (every operator gets a fresh
+        deepcopy of the state, as in earlier versions).
+        engine is 'recursive' (seek_plan) or 'iterative' (seek_plan_iterative,
+        which keeps its own stack and is not bound by Python's recursion limit)
+        or 'best_first' (seek_plan_best_first, which returns the shortest plan
+        when weight is 1 and heuristic never overestimates).
+        heuristic(state, tasks) estimates how many operator steps are still
+        needed; best-first search expands nodes in order of
+        steps so far + weight * heuristic.
+        max_depth is the decomposition depth budget; None means unbounded.
+        memo_size turns on a TranspositionTable of that many failed
+        (state, tasks) pairs, kept across planner() calls. It is ignored for
+        domains declared impure.
+        stats is a PlannerStats that every run adds its counters and timings
+        to; with None (the default) no bookkeeping is done.
+        record_tree makes every Solution carry its decomposition tree.
+        """
+        if state_mode not in ('undo', 'copy'):
+            raise ValueError('Unknown state mode: %s' % state_mode)
+        if engine not in ('recursive', 'iterative', 'best_first'):
+            raise ValueError('Unknown engine: %s' % engine)
+        self.__name__ = name
+        self.domain = domain if domain is not None else Domain(name)
+        self.state_mode = state_mode
+        self.engine = engine
+        self.max_depth = max_depth
+        self.planningsteps = dict()
+        self.result = []
+        self.memo = TranspositionTable(memo_size) if memo_size else None
+        self.heuristic = heuristic
+        self.weight = weight
+        self.nodes_expanded = 0
+        self.stats = stats
+        self.record_tree = record_tree
+        self._frozen = {}
+
+    @property
+    def operators(self):
+        return self.domain.operators
+
+    @property
+    def methods(self):
+        return self.domain.methods
+
+    def declare_operators(self, *op_list):
+        return self.domain.declare_operators(*op_list)
+
+    def declare_methods(self, task_name, *method_list):
+        return self.domain.declare_methods(task_name, *method_list)
+
     def planner(self, state, tasks):
-        self.result = self.seek_plan(state, tasks, [], 0)
+        """
+        Plans tasks from state. Returns the plan as a Solution, or False if
+        there is none, and also keeps it in self.result.
+        """
+        if self.stats is not None:
+            return self._instrumented_planner(state, tasks)
+        if self.state_mode == 'copy':
+            self.result = self.search(state, tasks)
+            return self.result
+        # Search runs in place on the journaled state; rolling back to the
+        # initial mark leaves it exactly as it was handed in.
+        state = journaled(state)
+        mark = state.checkpoint()
+        try:
+            self.result = self.search(state, tasks)
+        finally:
+            state.rollback(mark)
+        return self.result
+
+    def _instrumented_planner(self, state, tasks):
+        stats = self.stats
+        if self.state_mode == 'copy':
+            with stats.phase('search'):
+                self.result = self.search(state, tasks)
+            return self.result
+        with stats.phase('prepare'):
+            prepared = journaled(state)
+            if prepared is not state:
+                stats.state_copies += 1
+            mark = prepared.checkpoint()
+        try:
+            with stats.phase('search'):
+                self.result = self.search(prepared, tasks)
+        finally:
+            with stats.phase('restore'):
+                prepared.rollback(mark)
+        return self.result
+
+    def search(self, state, tasks):
+        self._frozen = {}
+        self.planningsteps.clear()
+        if self.engine == 'iterative':
+            return self.seek_plan_iterative(state, tasks)
+        if self.engine == 'best_first':
+            return self.seek_plan_best_first(state, tasks)
+        return self.seek_plan(state, tasks, [], 0)
+
+    def _active_memo(self):
+        if self.memo is not None and self.domain.pure:
+            return self.memo
+        return None
+
+    def _memo_key(self, state, tasks):
+        # Task arguments (goals) do not change during a search, so their
+        # frozen form is cached for the run; the state is frozen every time.
+        return (freeze(state), freeze(tasks, self._frozen))
+
+    def _budget(self, depth):
+        return None if self.max_depth is None else self.max_depth - depth
+
+    def _apply(self, operator, state, task):
+        """
+        Applies operator for task. Returns (newstate, mark), where mark is the
+        checkpoint to roll state back to, or None in copy mode.
+        """
+        stats = self.stats
+        if self.state_mode == 'copy':
+            state = _clone(state, stats) if stats is not None else copy.deepcopy(state)
+            mark = None
+        else:
+            mark = state.checkpoint()
+        if stats is None:
+            return operator(state, *task[1:]), mark
+        start = clock()
+        newstate = operator(state, *task[1:])
+        stats.operator_applied(operator, clock() - start, newstate)
+        return newstate, mark
+
+    def _step(self, task):
+        return (None, task, 0) if self.record_tree else task
+
+    def _decomposition(self, method, task, subtasks):
+        return (method.__name__, task, len(subtasks))
+
+    def _solution(self, entries, roots):
+        if not self.record_tree:
+            return Solution(entries)
+        return Solution([e[1] for e in entries if e[0] is None], _build_tree(entries, roots))
+
+    def _decompose(self, method, state, task):
+        stats = self.stats
+        if stats is None:
+            return method(state, *task[1:])
+        start = clock()
+        subtasks = method(state, *task[1:])
+        stats.method_called(method, clock() - start)
+        if subtasks == False:
+            stats.method_failed(method)
+        return subtasks
 
     def seek_plan(self, state, tasks, plan, depth):
-        if depth>50:
+        """
+        Recursive depth-first search. plan is the list of steps already
+        taken; returns a Solution or False.
+        """
+        chain = None
+        for task in plan:
+            chain = (self._step(task), chain)
+        solution = self._seek_plan(state, tasks, chain, depth)
+        if solution is False:
+            return False
+        return self._solution(_unwind(solution), len(plan) + len(tasks))
+
+    def _seek_plan(self, state, tasks, plan, depth):
+        # plan is a linked chain of (entry, rest) pairs, so extending it for a
+        # child never copies the steps taken so far.
+        if self.max_depth is not None and depth > self.max_depth:
             return False
         if tasks == []:
             return plan
+        memo = self._active_memo()
+        if memo is not None:
+            key = self._memo_key(state, tasks)
+            if memo.failed(key, self._budget(depth)):
+                return False
+        stats = self.stats
+        if stats is not None:
+            stats.expanded(depth)
         task = tasks[0]
-        if task[0] in self.operators:
+        operator, relevant = self.domain.dispatch.get(task[0], (None, ()))
+        if operator is not None:
             self.planningsteps[depth] = ['operator', task]
-            #print('depth {} action {}'.format(depth,task))
-            operator = self.operators[task[0]]
-            newstate = operator(copy.deepcopy(state), *task[1:])
+            newstate, mark = self._apply(operator, state, task)
             if newstate:
-                solution = self.seek_plan(
-                    newstate, tasks[1:], plan + [task], depth + 1)
+                solution = self._seek_plan(
+                    newstate, tasks[1:], (self._step(task), plan), depth + 1)
                 if solution != False:
                     return solution
-        if task[0] in self.methods:
+                if stats is not None:
+                    stats.backtracks += 1
+            if mark is not None:
+                state.rollback(mark)
+        if relevant:
             self.planningsteps[depth] = ['method', task]
-            #print('depth {} method instance {}'.format(depth,task))
-            relevant = self.methods[task[0]]
             for method in relevant:
-                subtasks = method(state, *task[1:])
+                subtasks = self._decompose(method, state, task)
                 if subtasks != False:
-                    solution = self.seek_plan(
-                        state, subtasks + tasks[1:], plan, depth + 1)
-                    if solution != False:
-                        return solution
+                    for subtasks in _decompositions(subtasks):
+                        subplan = plan
+                        if self.record_tree:
+                            subplan = (self._decomposition(method, task, subtasks), plan)
+                        solution = self._seek_plan(
+                            state, subtasks + tasks[1:], subplan, depth + 1)
+                        if solution != False:
+                            return solution
+                        if stats is not None:
+                            stats.backtracks += 1
+                    if stats is not None:
+                        stats.method_failed(method)
+        if memo is not None:
+            memo.record(key, self._budget(depth))
         return False
+
+    def seek_plan_iterative(self, state, tasks):
+        """
+        Same search as seek_plan, but driven off an explicit stack of
+        expansion generators instead of Python recursion. Plans are
+        identical to the recursive engine's for the same depth budget.
+        """
+        plan = []
+        if tasks == []:
+            return Solution(plan, [] if self.record_tree else None)
+        memo = self._active_memo()
+        stack = []
+        child = (state, tasks, 0)
+        while True:
+            if child is not None:
+                newstate, newtasks, depth = child
+                if self.max_depth is not None and depth > self.max_depth:
+                    pass
+                elif newtasks == []:
+                    return self._solution(plan, len(tasks))
+                elif memo is None:
+                    stack.append((self._expand(newstate, newtasks, plan, depth), None, depth))
+                else:
+                    key = self._memo_key(newstate, newtasks)
+                    if not memo.failed(key, self._budget(depth)):
+                        stack.append((self._expand(newstate, newtasks, plan, depth), key, depth))
+            if not stack:
+                return False
+            expansions, key, depth = stack[-1]
+            try:
+                child = next(expansions)
+            except StopIteration:
+                stack.pop()
+                child = None
+                if memo is not None:
+                    memo.record(key, self._budget(depth))
+
+    def _expand(self, state, tasks, plan, depth):
+        """
+        Yields (state, tasks, depth) for each child of a search node, in the
+        order seek_plan tries them. Resuming the generator backtracks out of
+        the previous child: plan is trimmed and the state rolled back.
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.expanded(depth)
+        task = tasks[0]
+        operator, relevant = self.domain.dispatch.get(task[0], (None, ()))
+        if operator is not None:
+            self.planningsteps[depth] = ['operator', task]
+            newstate, mark = self._apply(operator, state, task)
+            if newstate:
+                plan.append(self._step(task))
+                yield newstate, tasks[1:], depth + 1
+                plan.pop()
+                if stats is not None:
+                    stats.backtracks += 1
+            if mark is not None:
+                state.rollback(mark)
+        if relevant:
+            self.planningsteps[depth] = ['method', task]
+            for method in relevant:
+                subtasks = self._decompose(method, state, task)
+                if subtasks != False:
+                    for subtasks in _decompositions(subtasks):
+                        if self.record_tree:
+                            plan.append(self._decomposition(method, task, subtasks))
+                            yield state, subtasks + tasks[1:], depth + 1
+                            plan.pop()
+                        else:
+                            yield state, subtasks + tasks[1:], depth + 1
+                        if stats is not None:
+                            stats.backtracks += 1
+                    if stats is not None:
+                        stats.method_failed(method)
+
+    def seek_plan_best_first(self, state, tasks):
+        """
+        Returns the first plan best-first search finds, or False. With
+        weight 1 and an admissible heuristic that is a shortest plan.
+        """
+        return next(self._best_first(state, tasks, self.weight, None), False)
+
+    def anytime(self, state, tasks, time_budget, weight=3.0):
+        """
+        Yields progressively shorter plans until time_budget seconds have
+        passed or the search proves the last plan shortest. The first plan
+        comes from a weighted (greedier) search; later ones prune every node
+        that cannot beat the best plan so far. self.result holds the best
+        plan and self.nodes_expanded the work done so far.
+        """
+        self.result = False
+        deadline = timeit.default_timer() + time_budget
+        for plan in self._best_first(state, tasks, weight, deadline):
+            self.result = plan
+            yield plan
+
+    def _best_first(self, state, tasks, weight, deadline):
+        self.nodes_expanded = 0
+        self._frozen = {}
+        heuristic = self.heuristic
+        roots = len(tasks)
+        seen = {} if self.domain.pure else None
+        order = itertools.count()
+        best = None
+        frontier = []
+        h = heuristic(state, tasks)
+        heapq.heappush(frontier, (weight * h, h, 0, 0, 0, state, tasks, None))
+        while frontier:
+            if deadline is not None and timeit.default_timer() > deadline:
+                return
+            f, h, _, g, depth, state, tasks, plan = heapq.heappop(frontier)
+            if best is not None and g + h >= best:
+                continue
+            if tasks == []:
+                best = g
+                yield self._solution(_unwind(plan), roots)
+                continue
+            self.nodes_expanded += 1
+            if self.stats is not None:
+                self.stats.expanded(depth)
+            if self.max_depth is not None and depth + 1 > self.max_depth:
+                continue
+            for newstate, newtasks, entry, cost in self._children(state, tasks):
+                newplan = plan if entry is None else (entry, plan)
+                newg = g + cost
+                newh = heuristic(newstate, newtasks)
+                if best is not None and newg + newh >= best:
+                    continue
+                if seen is not None:
+                    key = self._memo_key(newstate, newtasks)
+                    if seen.get(key, newg + 1) <= newg:
+                        continue
+                    seen[key] = newg
+                # Among equally good nodes prefer the most recent one, which
+                # keeps the search diving toward a first solution.
+                heapq.heappush(frontier, (newg + weight * newh, newh, -next(order),
+                                          newg, depth + 1, newstate, newtasks, newplan))
+
+    def _children(self, state, tasks):
+        """
+        Yields (state, tasks, entry, cost) for each child of a best-first
+        node. Operators are applied to a copy so that queued states never
+        change. entry is what the child adds to the plan chain (None if
+        nothing) and cost the number of operator steps it adds.
+        """
+        task = tasks[0]
+        operator, relevant = self.domain.dispatch.get(task[0], (None, ()))
+        if operator is not None:
+            stats = self.stats
+            state_copy = _clone(state, stats)
+            if stats is None:
+                newstate = operator(state_copy, *task[1:])
+            else:
+                start = clock()
+                newstate = operator(state_copy, *task[1:])
+                stats.operator_applied(operator, clock() - start, newstate)
+            if newstate:
+                yield newstate, tasks[1:], self._step(task), 1
+        for method in relevant:
+            subtasks = self._decompose(method, state, task)
+            if subtasks != False:
+                for subtasks in _decompositions(subtasks):
+                    entry = None
+                    if self.record_tree:
+                        entry = self._decomposition(method, task, subtasks)
+                    yield state, subtasks + tasks[1:], entry, 0
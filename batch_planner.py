@@ -0,0 +1,98 @@
+from __future__ import print_function
+import functools
+import multiprocessing
+import multiprocessing.pool
+import pickle
+import timeit
+import traceback
+import warnings
+from collections import namedtuple
+
+from HTN import HTNPlanner
+
+"""Solves many independent (state, tasks) problems over one shared domain.
+
+Problems are spread over a process pool. The domain is sent to each worker
+once, through the pool initializer, rather than with every problem. If a
+process pool cannot be used (the domain does not pickle, or the platform
+cannot start worker processes) the batch falls back to a thread pool.
+"""
+
+BatchResult = namedtuple('BatchResult', ['index', 'plan', 'seconds', 'error'])
+
+_worker_domain = None
+_worker_options = None
+
+
+def _init_worker(domain, options):
+    global _worker_domain, _worker_options
+    _worker_domain = domain
+    _worker_options = options
+
+
+def _solve(domain, options, problem):
+    index, state, tasks = problem
+    start = timeit.default_timer()
+    try:
+        planner = HTNPlanner(domain.__name__, domain, **options)
+        planner.planner(state, tasks)
+        return BatchResult(index, planner.result, timeit.default_timer() - start, None)
+    except Exception:
+        return BatchResult(index, False, timeit.default_timer() - start, traceback.format_exc())
+
+
+def _solve_in_worker(problem):
+    return _solve(_worker_domain, _worker_options, problem)
+
+
+def _round_trip(problem):
+    try:
+        pickle.loads(pickle.dumps(problem))
+        return None
+    except Exception:
+        return BatchResult(problem[0], False, 0.0, traceback.format_exc())
+
+
+def plan_batch(domain, problems, workers=None, executor='process', chunksize=1, **options):
+    """
+    Plans every problem in problems.
+    :param domain: HTN.Domain shared by all problems
+    :param problems: iterable of (state, tasks) pairs
+    :param workers: pool size, defaults to the number of CPUs
+    :param executor: 'process' or 'thread'
+    :param chunksize: problems handed to a worker at a time
+    :param options: keyword arguments for each HTNPlanner (state_mode, engine, ...)
+    :return: list of BatchResult(index, plan, seconds, error) in input order. plan
+        is False and error holds the traceback if planning raised, or, with the
+        process executor, if the problem could not be pickled and unpickled.
+    """
+    if executor not in ('process', 'thread'):
+        raise ValueError('Unknown executor: %s' % executor)
+    work = [(i, state, tasks) for i, (state, tasks) in enumerate(problems)]
+    workers = workers or multiprocessing.cpu_count()
+
+    if executor == 'process':
+        try:
+            pickle.dumps(domain)
+            pool = multiprocessing.Pool(workers, _init_worker, (domain, options))
+        except (pickle.PicklingError, AttributeError, TypeError, OSError, ImportError) as e:
+            warnings.warn('Process pool unavailable (%s), using threads' % e, RuntimeWarning)
+        else:
+            failed = {}                                 # A problem a worker cannot unpickle would never come back
+            for problem in work:
+                result = _round_trip(problem)
+                if result is not None:
+                    failed[problem[0]] = result
+            try:
+                solved = pool.imap(_solve_in_worker, [p for p in work if p[0] not in failed], chunksize)
+                return [failed.get(i) or next(solved) for i, _, _ in work]
+            finally:
+                pool.close()
+                pool.join()
+
+    pool = multiprocessing.pool.ThreadPool(workers)
+    try:
+        return list(pool.imap(functools.partial(_solve, domain, options), work, chunksize))
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from HTN import *
+import Baxter_Blocks_World
+from batch_planner import plan_batch
+from compact_state import compact_problem
+from data import Data
+from input_parser import InputParser
+from instrumentation import PlannerStats
+
+"""Benchmarks for the HTN planner and its state engines.
+
+Run from the command line, e.g.
+
+    python benchmark.py state --sizes 10 100 1000
+    python benchmark.py batch --problems 200 --blocks 100
+    python benchmark.py suite --sizes 10 100 1000 --output results.json
+    python benchmark.py load --blocks 100000
+    python benchmark.py parse --sentences 100000
+"""
+
+
+def make_problem(start, target):
+    """
+    :param start: list of (block, position) pairs in the order the state's
+        pos dict should list them
+    :param target: dict of block -> goal position
+    :return: (state, goal) in the same shape as formulate_problem()
+    """
+    state = State('Start state')
+    state.holdingL = False
+    state.holdingR = False
+    state.pos = dict(start)
+    state.delete = {'t1': False, 't2': False, 'center': False}
+
+    goal = Goal('Goal')
+    goal.holdingL = False
+    goal.holdingR = False
+    goal.pos = dict(target)
+    goal.delete = {'t1': False, 't2': False, 'center': False}
+    return (state, goal)
+
+
+def baxter_problem(n, rng):
+    """
+    Builds a Baxter two-table problem with n blocks. One block starts on
+    each of t1 and t2 and the rest wait in the center; the goal swaps the
+    two table blocks.
+    :param n: number of blocks (at least 2)
+    :param rng: random.Random used to name the table blocks
+    :return: (state, goal)
+    """
+    blocks = ['b%d' % i for i in range(n)]
+    on_t1, on_t2 = rng.sample(blocks, 2)
+    start = [(b, 't1' if b == on_t1 else 't2' if b == on_t2 else 'center') for b in blocks]
+    target = dict(start)
+    target[on_t1] = 't2'
+    target[on_t2] = 't1'
+    return make_problem(start, target)
+
+
+def _place_randomly(blocks, rng):
+    # t1 and t2 each hold at most one block, so each gets one or stays empty.
+    where = dict((b, 'center') for b in blocks)
+    for table in ('t1', 't2'):
+        free = [b for b in blocks if where[b] == 'center']
+        if free and rng.random() < 0.8:
+            where[rng.choice(free)] = table
+    return where
+
+
+def random_problem(n, rng):
+    """
+    Random start and goal placements of n blocks over t1, t2 and center.
+    """
+    blocks = ['b%d' % i for i in range(n)]
+    where = _place_randomly(blocks, rng)
+    return make_problem([(b, where[b]) for b in blocks], _place_randomly(blocks, rng))
+
+
+def adversarial_problem(n, rng):
+    """
+    The t1/t2 swap, with both table blocks listed last in pos so that
+    moveb_m scans every block in the center before finding work, and with
+    center blocks that must move onto the freed tables.
+    """
+    blocks = ['b%d' % i for i in range(n)]
+    rng.shuffle(blocks)
+    on_t1, on_t2 = blocks[-2:]
+    start = [(b, 'center') for b in blocks[:-2]] + [(on_t1, 't1'), (on_t2, 't2')]
+    target = dict(start)
+    target[on_t1] = 'center'
+    target[on_t2] = 't1'
+    if n > 2:
+        target[blocks[0]] = 't2'
+    return make_problem(start, target)
+
+
+GENERATORS = {'swap': baxter_problem, 'random': random_problem, 'adversarial': adversarial_problem}
+
+
+def bench_state(sizes, repeat, seed):
+    """
+    Times one operator expansion (apply pickup, then restore the parent
+    state for backtracking) in the 'copy' and 'undo' state modes, for
+    plain and compact states.
+    :return: list of result dicts, one per size and mode
+    """
+    rng = random.Random(seed)
+    pickup = Baxter_Blocks_World.pickup
+    results = []
+    for n in sizes:
+        state, goal = baxter_problem(n, rng)
+        block = [b for b in state.pos if state.pos[b] == 'center'][0]
+
+        def copy_expand():
+            pickup(copy.deepcopy(state), block, 'left')
+
+        undo_state = UndoState.from_state(state)
+
+        def undo_expand():
+            mark = undo_state.checkpoint()
+            pickup(undo_state, block, 'left')
+            undo_state.rollback(mark)
+
+        compact, compact_goal = compact_problem(state, goal)
+
+        def compact_copy_expand():
+            pickup(copy.deepcopy(compact), block, 'left')
+
+        def compact_undo_expand():
+            mark = compact.checkpoint()
+            pickup(compact, block, 'left')
+            compact.rollback(mark)
+
+        for mode, expand in (('copy', copy_expand), ('undo', undo_expand),
+                             ('compact-copy', compact_copy_expand),
+                             ('compact-undo', compact_undo_expand)):
+            number = max(1, 20000 // n)
+            best = min(timeit.repeat(expand, number=number, repeat=repeat))
+            results.append({'blocks': n, 'mode': mode,
+                            'usec_per_expansion': best / number * 1e6})
+    return results
+
+
+def bench_batch(problems, blocks, workers, seed):
+    """
+    Plans the same set of problems with the serial loop used by
+    Baxter_Blocks_World.main (a freshly declared planner per problem) and
+    with plan_batch over process and thread pools.
+    :return: list of result dicts, one per strategy
+    """
+    rng = random.Random(seed)
+    work = []
+    for i in range(problems):
+        state, goal = baxter_problem(blocks, rng)
+        work.append((state, [('move_blocks', goal)]))
+
+    def serial():
+        plans = []
+        for state, tasks in work:
+            HTNplanner = HTNPlanner("Baxter_World")
+            HTNplanner.declare_operators(Baxter_Blocks_World.place, Baxter_Blocks_World.pickup)
+            HTNplanner.declare_methods('put', Baxter_Blocks_World.put_m)
+            HTNplanner.declare_methods('get', Baxter_Blocks_World.get_m)
+            HTNplanner.declare_methods('move_one', Baxter_Blocks_World.move1)
+            HTNplanner.declare_methods('move_blocks', Baxter_Blocks_World.moveb_m)
+            HTNplanner.planner(state, tasks)
+            plans.append(HTNplanner.result)
+        return plans
+
+    domain = Baxter_Blocks_World.make_domain()
+    results = []
+    for name, run in (('serial', serial),
+                      ('process', lambda: [r.plan for r in plan_batch(domain, work, workers)]),
+                      ('thread', lambda: [r.plan for r in plan_batch(domain, work, workers, 'thread')])):
+        start = timeit.default_timer()
+        plans = run()
+        seconds = timeit.default_timer() - start
+        results.append({'strategy': name, 'problems': problems, 'blocks': blocks,
+                        'seconds': seconds, 'solved': sum(1 for p in plans if p != False)})
+    return results
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values, q in [0, 100]."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, int(-(-q * len(ordered) // 100)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _summary(values):
+    return dict(('p%d' % q, percentile(values, q)) for q in (50, 90, 99)) if values else {}
+
+
+def bench_suite(kinds, sizes, problems, engines, seed, memory=True):
+    """
+    Plans problems generated problems of every kind and size with every
+    engine and summarizes time to plan, nodes expanded, peak memory and
+    plan length as percentiles.
+    :return: list of result dicts, one per (kind, size, engine)
+    """
+    results = []
+    for kind in kinds:
+        for n in sizes:
+            rng = random.Random('%s-%s-%s' % (seed, kind, n))
+            work = [GENERATORS[kind](n, rng) for i in range(problems)]
+            for engine in engines:
+                domain = Baxter_Blocks_World.make_domain(alternatives=engine == 'best_first')
+                heuristic = Baxter_Blocks_World.blocks_out_of_place if engine == 'best_first' else zero_heuristic
+                seconds, nodes, peaks, lengths, failed = [], [], [], [], 0
+                for state, goal in work:
+                    stats = PlannerStats()
+                    planner = HTNPlanner('bench', domain, engine=engine, max_depth=None,
+                                         heuristic=heuristic, stats=stats)
+                    start = timeit.default_timer()
+                    plan = planner.planner(state, [('move_blocks', goal)])
+                    seconds.append(timeit.default_timer() - start)
+                    nodes.append(stats.nodes_expanded)
+                    if plan is False:
+                        failed += 1
+                    else:
+                        lengths.append(len(plan))
+                    if memory and tracemalloc is not None:
+                        # A separate run, so tracing does not skew the timings.
+                        tracemalloc.start()
+                        HTNPlanner('bench', domain, engine=engine, max_depth=None,
+                                   heuristic=heuristic).planner(state, [('move_blocks', goal)])
+                        peaks.append(tracemalloc.get_traced_memory()[1])
+                        tracemalloc.stop()
+                results.append({'kind': kind, 'blocks': n, 'engine': engine,
+                                'problems': problems, 'failed': failed,
+                                'seconds': _summary(seconds), 'nodes_expanded': _summary(nodes),
+                                'peak_bytes': _summary(peaks), 'plan_length': _summary(lengths)})
+    return results
+
+
+def bench_load(blocks, baseline_blocks):
+    """
+    Loads a workspace of blocks, each on the table, into a fresh database.
+    The baseline is the one-commit-per-call path (add_block and set_on in a
+    loop). Each call is an indexed lookup plus a commit, so its cost per
+    block is about constant but dominated by the commit; it is timed on the
+    first baseline_blocks blocks only and extrapolated linearly to blocks.
+    The batched path uses add_blocks and set_on_many inside one
+    Data.batch().
+    :return: list of result dicts, one per strategy; 'extrapolated' holds the
+        estimated seconds for all blocks when only some were timed
+    """
+    names = ['b%d' % i for i in range(blocks)]
+    directory = tempfile.mkdtemp()
+    try:
+        data = Data(os.path.join(directory, 'baseline.db'))
+        start = timeit.default_timer()
+        for name in names[:baseline_blocks]:
+            data.add_block(name)
+            data.set_on(name, 'table')
+        baseline = timeit.default_timer() - start
+
+        data = Data(os.path.join(directory, 'batched.db'))
+        start = timeit.default_timer()
+        with data.batch():
+            data.add_blocks(names)
+            data.set_on_many((name, 'table') for name in names)
+        batched = timeit.default_timer() - start
+    finally:
+        shutil.rmtree(directory)
+    timed = min(blocks, baseline_blocks)
+    return [{'strategy': 'per-call commits', 'blocks': timed, 'seconds': baseline,
+             'extrapolated': baseline * blocks / max(1, timed) if timed < blocks else None},
+            {'strategy': 'batched', 'blocks': blocks, 'seconds': batched, 'extrapolated': None}]
+
+
+def parse_corpus(sentences, rng):
+    """
+    Generates sentences of every kind InputParser knows, plus some it
+    rejects, over a vocabulary of a few hundred block and type names.
+    """
+    blocks = ['b%d' % i for i in range(200)]
+    types = ['t%d' % i for i in range(50)]
+    forms = [
+        lambda: '%s is a block.' % rng.choice(blocks),
+        lambda: '%s is a type.' % rng.choice(types),
+        lambda: 'is %s %s?' % (rng.choice(blocks), rng.choice(types)),
+        lambda: 'are all current blocks that are %s %s?' % (rng.choice(types), rng.choice(types)),
+        lambda: '%s is %s.' % (rng.choice(blocks), rng.choice(types)),
+        lambda: 'all current blocks that are %s are %s.' % (rng.choice(types), rng.choice(types)),
+        lambda: ', '.join('on(%s,%s)' % (rng.choice(blocks), rng.choice(blocks))
+                          for _ in range(rng.randint(1, 4))) + '.',
+        lambda: 'display data.',
+        lambda: 'what is %s on?' % rng.choice(blocks),
+        lambda: 'is %s on %s?' % (rng.choice(blocks), rng.choice(blocks)),
+        lambda: 'move %s somewhere.' % rng.choice(blocks),
+    ]
+    return [rng.choice(forms)() for _ in range(sentences)]
+
+
+def bench_parse(sentences, repeat, seed):
+    """
+    Times InputParser.parse over a generated corpus.
+    :return: result dict with the best of repeat runs
+    """
+    corpus = parse_corpus(sentences, random.Random(seed))
+    parse = InputParser().parse
+    best = min(timeit.repeat(lambda: [parse(s) for s in corpus], number=1, repeat=repeat))
+    rejected = sum(1 for s in corpus if parse(s) is None)
+    return {'sentences': sentences, 'rejected': rejected, 'seconds': best,
+            'usec_per_sentence': best / max(1, sentences) * 1e6}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='HTN planner benchmarks')
+    sub = parser.add_subparsers(dest='bench')
+    state = sub.add_parser('state', help='per-expansion cost of the state engines')
+    state.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    state.add_argument('--repeat', type=int, default=5)
+    state.add_argument('--seed', type=int, default=0)
+    batch = sub.add_parser('batch', help='batch planning against the serial loop')
+    batch.add_argument('--problems', type=int, default=200)
+    batch.add_argument('--blocks', type=int, default=100)
+    batch.add_argument('--workers', type=int, default=None)
+    batch.add_argument('--seed', type=int, default=0)
+    suite = sub.add_parser('suite', help='planner regression suite over generated workspaces')
+    suite.add_argument('--kinds', nargs='+', choices=sorted(GENERATORS),
+                       default=['swap', 'random', 'adversarial'])
+    suite.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    suite.add_argument('--problems', type=int, default=20)
+    suite.add_argument('--engines', nargs='+', choices=['recursive', 'iterative', 'best_first'],
+                       default=['recursive', 'iterative', 'best_first'])
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--no-memory', action='store_true', help='skip peak memory measurement')
+    suite.add_argument('--output', help='write JSON results here instead of stdout')
+    load = sub.add_parser('load', help='bulk loading blocks into data.Data')
+    load.add_argument('--blocks', type=int, default=100000)
+    load.add_argument('--baseline-blocks', type=int, default=2000,
+                      help='blocks loaded through the slow per-call path')
+    parse = sub.add_parser('parse', help='InputParser over a generated corpus')
+    parse.add_argument('--sentences', type=int, default=100000)
+    parse.add_argument('--repeat', type=int, default=5)
+    parse.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv[1:])
+
+    if args.bench == 'state':
+        print('%8s %12s %20s' % ('blocks', 'mode', 'usec/expansion'))
+        for r in bench_state(args.sizes, args.repeat, args.seed):
+            print('%8d %12s %20.2f' % (r['blocks'], r['mode'], r['usec_per_expansion']))
+    elif args.bench == 'batch':
+        print('%8s %9s %8s %10s %8s' % ('strategy', 'problems', 'blocks', 'seconds', 'solved'))
+        for r in bench_batch(args.problems, args.blocks, args.workers, args.seed):
+            print('%8s %9d %8d %10.3f %8d' % (r['strategy'], r['problems'], r['blocks'],
+                                               r['seconds'], r['solved']))
+    elif args.bench == 'suite':
+        results = bench_suite(args.kinds, args.sizes, args.problems, args.engines,
+                              args.seed, not args.no_memory)
+        text = json.dumps(results, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+    elif args.bench == 'load':
+        print('%18s %8s %10s %14s' % ('strategy', 'blocks', 'seconds', 'usec/block'))
+        results = bench_load(args.blocks, args.baseline_blocks)
+        for r in results:
+            print('%18s %8d %10.3f %14.1f' % (r['strategy'], r['blocks'], r['seconds'],
+                                              r['seconds'] / max(1, r['blocks']) * 1e6))
+        for r in results:
+            if r['extrapolated'] is not None:
+                print('%s: partial run of %d of %d blocks, about %.1f seconds for all %d'
+                      % (r['strategy'], r['blocks'], args.blocks, r['extrapolated'], args.blocks))
+    elif args.bench == 'parse':
+        r = bench_parse(args.sentences, args.repeat, args.seed)
+        print('%10s %9s %10s %18s' % ('sentences', 'rejected', 'seconds', 'usec/sentence'))
+        print('%10d %9d %10.3f %18.2f' % (r['sentences'], r['rejected'], r['seconds'], r['usec_per_sentence']))
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,132 @@
+from __future__ import print_function
+import argparse
+import sys
+
+from data import CachedData, Data
+from input_parser import InputParser
+from settings import DATABASE
+from world_operator import WorldOperator
+
+"""Runs a stream of sentences through InputParser and WorldOperator.
+
+Sentences are read one per line from a file or stdin and flow through a
+pipeline of generators: read_sentences -> parse_commands -> execute_commands.
+Consecutive commands that write (see WorldOperator.writes) are executed in
+one Data transaction, each inside its own nested batch so a command that
+fails is rolled back alone. Responses are written as soon as their
+transaction commits.
+
+With --merge-goals the set_on_set requests of such a run are queued and
+planned together at its end, and the merged plan gets its own response.
+
+    python command_runner.py world.txt
+    python command_runner.py --keep --no-cache < queries.txt
+"""
+
+
+def read_sentences(lines):
+    """Yields every non-blank line of lines, stripped."""
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def parse_commands(sentences, parser=None):
+    """Yields (sentence, (command, args) or None) for every sentence."""
+    parser = parser or InputParser()
+    for sentence in sentences:
+        yield sentence, parser.parse(sentence)
+
+
+def _run(operator, sentence, parsed):
+    if parsed is None:
+        return sentence, 'Unrecognized sentence: %s' % sentence
+    try:
+        with operator.db.batch():
+            return sentence, operator.execute(*parsed)
+    except Exception as e:
+        return sentence, 'Error: %s' % e
+
+
+def _flush_goals(operator):
+    try:
+        with operator.db.batch():
+            return 'merged goals', operator.flush_goals()
+    except Exception as e:
+        return 'merged goals', 'Error: %s' % e
+
+
+def _run_group(operator, group):
+    if not group:
+        return []
+    with operator.db.batch():
+        results = [_run(operator, sentence, parsed) for sentence, parsed in group]
+        if operator.goals:
+            results.append(_flush_goals(operator))
+    del group[:]
+    return results
+
+
+def execute_commands(commands, operator, batch_size=1000):
+    """
+    Executes every parsed command.
+    :param commands: iterable of (sentence, (command, args) or None), as from parse_commands
+    :param operator: WorldOperator to execute them with
+    :param batch_size: most writes committed in one transaction
+    :return: generator of (sentence, response), in input order
+    """
+    group = []
+    for sentence, parsed in commands:
+        writes = parsed is not None and operator.writes(parsed[0])
+        if writes:
+            group.append((sentence, parsed))
+            if len(group) < batch_size:
+                continue
+        for result in _run_group(operator, group):
+            yield result
+        if not writes:
+            yield _run(operator, sentence, parsed)
+    for result in _run_group(operator, group):
+        yield result
+
+
+def run(lines, operator, out, batch_size=1000, echo=False):
+    """
+    Executes the sentences in lines and writes a response line for each to out.
+    :return: number of sentences executed
+    """
+    count = 0
+    commands = parse_commands(read_sentences(lines))
+    for sentence, response in execute_commands(commands, operator, batch_size):
+        if echo:
+            out.write('> %s\n' % sentence)
+        out.write('%s\n' % response)
+        count += 1
+    out.flush()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute blocks-world sentences read from a file or stdin.')
+    parser.add_argument('input', nargs='?', default='-', help='file of sentences, one per line (default: stdin)')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--keep', action='store_true', help='open the existing database instead of wiping it')
+    parser.add_argument('--no-cache', action='store_true', help='read from SQLite directly instead of CachedData')
+    parser.add_argument('--batch-size', type=int, default=1000, help='most writes committed in one transaction')
+    parser.add_argument('--echo', action='store_true', help='write each sentence before its response')
+    parser.add_argument('--merge-goals', action='store_true',
+                        help='plan the set_on_set requests of each run of writes in one search')
+    args = parser.parse_args(argv)
+
+    data_class = Data if args.no_cache else CachedData
+    operator = WorldOperator(data_class(args.database, wipe=not args.keep), args.merge_goals)
+    if args.input == '-':
+        run(sys.stdin, operator, sys.stdout, args.batch_size, args.echo)
+    else:
+        with open(args.input) as lines:
+            run(lines, operator, sys.stdout, args.batch_size, args.echo)
+
+
+if __name__ == '__main__':
+    main()
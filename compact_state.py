@@ -0,0 +1,279 @@
+from __future__ import print_function
+from array import array
+
+from HTN import State
+
+"""Compact, hashable planning states.
+
+A CompactState stores every variable binding of a State as a small integer
+in one array. Block names, locations and flags are interned in a
+SymbolTable shared by all states of a problem, so copying a state is a
+single array copy and hashing it never touches a string.
+
+Operators keep working unchanged: state.holdingL reads and writes the
+interned value, and state.pos / state.delete behave like the dicts they
+replace, as long as only existing keys are written.
+"""
+
+LOCATIONS = ('t1', 't2', 'center', 'left', 'right')
+
+
+class SymbolTable():
+
+    """Interns hashable values as consecutive integer ids."""
+
+    def __init__(self, values=()):
+        self.ids = {}
+        self.values = []
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value):
+        """
+        Note that equal values share an id, so 1 and True come back as
+        whichever of the two was interned first.
+        """
+        try:
+            return self.ids[value]
+        except KeyError:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+            return i
+        except TypeError:
+            raise TypeError('Compact states can only hold hashable values, not %r' % (value,))
+
+
+class FieldView():
+
+    """Dict-like view of one dict-valued field of a CompactState."""
+
+    __slots__ = ('_state', '_index')
+
+    def __init__(self, state, index):
+        self._state = state
+        self._index = index
+
+    def __getitem__(self, key):
+        state = self._state
+        return state._layout.symbols.values[state._values[self._index[key]]]
+
+    def __setitem__(self, key, value):
+        try:
+            i = self._index[key]
+        except KeyError:
+            raise KeyError('%r is not a key of this compact state' % (key,))
+        self._state._write(i, self._state._layout.symbols.intern(value))
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items()) if hasattr(other, 'items') else False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+    def keys(self):
+        return list(self._index)
+
+    def values(self):
+        return [self[key] for key in self._index]
+
+    def items(self):
+        return [(key, self[key]) for key in self._index]
+
+
+class Layout():
+
+    """Where each field of a family of compact states lives in the value array.
+
+    scalars maps a field name to its array position; fields maps a dict
+    field name to a {key: array position} index. key is a hashable form of
+    both, equal for layouts that place every binding alike. state_class is
+    the CompactState subclass with one property per field.
+    """
+
+    def __init__(self, symbols, scalars, fields):
+        self.symbols = symbols
+        self.scalars = scalars
+        self.fields = fields
+        self.key = (frozenset(scalars.items()),
+                    frozenset((name, frozenset(index.items())) for name, index in fields.items()))
+        self.size = len(scalars) + sum(len(index) for index in fields.values())
+        self.state_class = _state_class(self)
+
+    def __getstate__(self):
+        return (self.symbols, self.scalars, self.fields)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class CompactState(object):
+
+    """Base class of the generated compact state classes."""
+
+    __slots__ = ('__name__', '_layout', '_values', '_log')
+
+    def __init__(self, name, layout, values):
+        self.__name__ = name
+        self._layout = layout
+        self._values = values
+        self._log = None
+
+    @classmethod
+    def from_state(cls, state, symbols=None):
+        """
+        Builds a compact copy of a State or Goal such as those returned by
+        formulate_problem(). Every attribute must be a hashable value or a
+        dict of hashable values.
+        :param state: State or Goal object
+        :param symbols: SymbolTable to share with other states of the problem
+        :return: CompactState
+        """
+        if symbols is None:
+            symbols = SymbolTable((False, True) + LOCATIONS)
+        attrs = [(k, v) for k, v in vars(state).items() if k != '__name__']
+        scalars = {}
+        fields = {}
+        offset = 0
+        for name, value in attrs:
+            if isinstance(value, dict):
+                fields[name] = dict((key, offset + i) for i, key in enumerate(value))
+                offset += len(value)
+            else:
+                scalars[name] = offset
+                offset += 1
+        layout = Layout(symbols, scalars, fields)
+        values = array('l', [0]) * layout.size
+        for name, value in attrs:
+            if name in fields:
+                for key, i in fields[name].items():
+                    values[i] = symbols.intern(value[key])
+            else:
+                values[scalars[name]] = symbols.intern(value)
+        return layout.state_class(getattr(state, '__name__', 'state'), layout, values)
+
+    def _write(self, i, value_id):
+        if self._log is not None:
+            self._log.append((i, self._values[i]))
+        self._values[i] = value_id
+
+    def checkpoint(self):
+        """Returns a mark that rollback() can restore the state to."""
+        if self._log is None:
+            self._log = []
+        return len(self._log)
+
+    def rollback(self, mark):
+        """Undoes every write made since checkpoint() returned mark."""
+        log = self._log
+        values = self._values
+        while len(log) > mark:
+            i, old = log.pop()
+            values[i] = old
+
+    def copy(self):
+        return self.__class__(self.__name__, self._layout, array('l', self._values))
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        return (_rebuild, (self.__name__, self._layout, self._values.tolist()))
+
+    def frozen(self):
+        """
+        Returns an immutable snapshot usable as a dict key. It names the
+        layout and symbol table along with the values, so that states of
+        different problems never share a key: the same array can mean
+        different bindings under another layout or symbol table.
+        """
+        layout = self._layout
+        return (layout.symbols, layout.key, tuple(self._values))
+
+    def __hash__(self):
+        return hash((self._layout.key, tuple(self._values)))
+
+    def __eq__(self, other):
+        """
+        States are equal when they bind the same values to the same fields,
+        even across layouts built separately or unpickled, as long as the
+        interned ids agree (so that equal states also hash equal).
+        """
+        if not isinstance(other, CompactState) or self._values != other._values:
+            return False
+        layout, other_layout = self._layout, other._layout
+        if layout is other_layout:
+            return True
+        if layout.key != other_layout.key:
+            return False
+        if layout.symbols is other_layout.symbols:
+            return True
+        mine, theirs = layout.symbols.values, other_layout.symbols.values
+        return all(mine[i] == theirs[i] for i in set(self._values))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def to_state(self, cls=None):
+        """Returns a plain State (or cls) with the same bindings."""
+        state = (cls or State)(self.__name__)
+        symbols = self._layout.symbols.values
+        for name, i in self._layout.scalars.items():
+            setattr(state, name, symbols[self._values[i]])
+        for name, index in self._layout.fields.items():
+            setattr(state, name, dict((k, symbols[self._values[i]]) for k, i in index.items()))
+        return state
+
+
+def _scalar_property(i):
+    def get(self):
+        return self._layout.symbols.values[self._values[i]]
+
+    def set(self, value):
+        self._write(i, self._layout.symbols.intern(value))
+    return property(get, set)
+
+
+def _field_property(index):
+    def get(self):
+        return FieldView(self, index)
+    return property(get)
+
+
+def _state_class(layout):
+    attrs = {'__slots__': ()}
+    for name, i in layout.scalars.items():
+        attrs[name] = _scalar_property(i)
+    for name, index in layout.fields.items():
+        attrs[name] = _field_property(index)
+    return type('CompactState', (CompactState,), attrs)
+
+
+def _rebuild(name, layout, values):
+    return layout.state_class(name, layout, array('l', values))
+
+
+def compact_problem(state, goal):
+    """
+    Converts the (state, goal) pair returned by formulate_problem() to
+    compact states that share one symbol table.
+    """
+    symbols = SymbolTable((False, True) + LOCATIONS)
+    return (CompactState.from_state(state, symbols), CompactState.from_state(goal, symbols))
@@ -1,30 +1,71 @@
 import sqlite3 as lite
 import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
 
 class Data:
     """
     Manages a database holding blocks and their properties and relations.
     """
-    def __init__(self, database, wipe=True):
+    def __init__(self, database, wipe=True, normalized=False, readers=0):
         """
-        if wipe == False:
+        if wipe == False, or wipe is None and the database already has tables:
             opens database
         else:
             Creates a database in file database, and initializes all tables and the 'on' relation
-        :param database: Filename of the database
-        :param wipe: Whether to clear the contents of the database
+        :param database: Filename of the database, ':memory:', or an SQLite URI such as
+            'file:world?mode=memory&cache=shared' (see in_memory)
+        :param wipe: Whether to clear the contents of the database. None keeps an existing world and creates a
+            new one only if the database has no tables yet.
+        :param normalized: When creating a database, store type membership in a types table and a (block, type)
+            membership table instead of one instance column per type. An opened database keeps whichever storage
+            it was created with.
+        :param readers: Number of read connections reader() can hand out to other threads at once. A database
+            file is switched to WAL mode so that they can read while this object writes. A private ':memory:'
+            database cannot have readers; use a shared-cache URI instead.
         :return:
         """
-        if wipe:
+        uri = database.startswith('file:')
+        if readers and database == ':memory:':
+            raise ValueError('A :memory: database is private to its connection; use Data.in_memory() for readers')
+
+        if wipe and not uri and database != ':memory:':
             try:
                 os.remove(database)
             except Exception as e:
                 print(e)
 
-        self.db = lite.connect(database)
+        self.database = database
+        self.db = lite.connect(database, cached_statements=256, uri=uri)
         self.cursor = self.db.cursor()
 
-        if wipe:
+        if wipe is None:
+            self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='instance'")
+            wipe = self.cursor.fetchone() is None
+        elif wipe and uri:
+            self._drop_tables()                                                                         # A shared in-memory database may already hold a world
+
+        if wipe and normalized:
+            self.cursor.execute('CREATE TABLE instance(name TEXT)')                                     # Contains each block
+            self.cursor.execute('CREATE TABLE types(name TEXT PRIMARY KEY)')                            # Contains each type. Every block is a block
+            self.cursor.execute('CREATE TABLE membership(block TEXT, type TEXT, PRIMARY KEY(block, type))')  # Block is of type
+            self.cursor.execute('CREATE TABLE on_relation(top TEXT, bottom TEXT)')                      # Block A is on Block B
+
+            self.cursor.execute("INSERT INTO types VALUES('block')")
+            self.cursor.execute("INSERT INTO instance(name) VALUES('table')")
+            self.cursor.execute("INSERT INTO membership VALUES('table', 'block')")
+
+            self.db.commit()
+        elif wipe:
             self.cursor.execute('CREATE TABLE instance(name TEXT, block INTEGER DEFAULT 1)')            # Contains each block. First column is name, other columns are type membership. Every block is a block
             self.cursor.execute('CREATE TABLE on_relation(top TEXT, bottom TEXT)')                      # Block A is on Block B
 
@@ -32,11 +73,226 @@ class Data:
 
             self.db.commit()
 
+        self._open(self.db)
+        self.create_indexes()
+
+        if readers:
+            if not _in_memory(database):
+                self.cursor.execute('PRAGMA journal_mode=WAL')
+            self.pool = ConnectionPool(database, readers)
+
+    @classmethod
+    def in_memory(cls, name='world', wipe=None, **kwargs):
+        """
+        Opens an in-memory database that other connections in this process can share by name. It lives until its
+        last connection closes. The first connection creates the world; later ones join it as it is.
+        :param name: name of the database
+        :param wipe: True to clear a world other connections already share; see the constructor
+        :param kwargs: further arguments for the constructor
+        :return: Data
+        """
+        return cls('file:%s?mode=memory&cache=shared' % name, wipe=wipe, **kwargs)
+
+    @staticmethod
+    def attach(connection):
+        """
+        Wraps an open connection to an existing database in a plain Data, without creating tables or indexes.
+        :param connection: sqlite3 connection
+        :return: Data
+        """
+        data = Data.__new__(Data)
+        data.database = None
+        data._open(connection)
+        return data
+
+    def _open(self, connection):
+        self.db = connection
+        self.cursor = connection.cursor()
+        self.batch_depth = 0
+        self.listeners = []
+        self.pool = None
+        self._detect_storage()
+
+    def _detect_storage(self):
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='types'")
+        self.normalized = self.cursor.fetchone() is not None
+
+    def _drop_tables(self):
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        for table in [f[0] for f in self.cursor.fetchall()]:
+            self.cursor.execute('DROP TABLE %s' % table)
+        self.db.commit()
+
+    def close(self):
+        """
+        Closes the connection and every pooled reader connection.
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+        self.db.close()
+
+    @contextmanager
+    def reader(self):
+        """
+        Lends a Data on a pooled connection, for reads from another thread while this object writes. It sees what
+        this object has committed; readers of an in-memory database can also see a batch that is still open.
+        Blocks while every pooled connection is lent out.
+        :return: Data
+        """
+        assert self.pool is not None, 'Database was opened without readers'
+        with self.pool.connection() as connection:
+            yield Data.attach(connection)
+
+    def snapshot(self, path):
+        """
+        Copies the whole database to file path with the SQLite backup API, e.g. to keep an in-memory world.
+        :param path: filename to write
+        :return: None
+        """
+        assert self.batch_depth == 0, 'Cannot snapshot inside a batch'
+        target = lite.connect(path)
+        try:
+            self.db.backup(target)
+        finally:
+            target.close()
+
+    def restore(self, path):
+        """
+        Replaces the whole database with the contents of file path, such as a snapshot.
+        :param path: filename to read
+        :return: None
+        """
+        assert self.batch_depth == 0, 'Cannot restore inside a batch'
+        source = lite.connect(path)
+        try:
+            source.backup(self.db)
+        finally:
+            source.close()
+
+        self._detect_storage()
+        self.create_indexes()
+        self._notify('reset')
+
+    def create_indexes(self):
+        """
+        Creates the lookup indexes if they are missing, so that databases made before they existed get them too.
+        A database that already holds duplicate block names gets a plain index on instance.name instead of a
+        unique one.
+        :return: None
+        """
+        try:
+            self.cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS instance_name ON instance(name)')
+        except lite.IntegrityError:
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS instance_name_dup ON instance(name)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS on_relation_top ON on_relation(top)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS on_relation_bottom ON on_relation(bottom)')
+        if self.normalized:
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS membership_type ON membership(type, block)')
+        self._commit()
+
+    def migrate_to_normalized(self):
+        """
+        Converts a database with one instance column per type to types and membership tables, in one transaction.
+        Does nothing if the database is already normalized.
+        :return: None
+        """
+        if self.normalized:
+            return
+
+        with self.batch():
+            types = self.list_types()
+            self.cursor.execute('CREATE TABLE types(name TEXT PRIMARY KEY)')
+            self.cursor.execute('CREATE TABLE membership(block TEXT, type TEXT, PRIMARY KEY(block, type))')
+            self.cursor.executemany('INSERT INTO types VALUES(?)', ((t,) for t in types))
+            for type_name in types:
+                self.cursor.execute('INSERT OR IGNORE INTO membership SELECT name, ? FROM instance WHERE %s=1'
+                                    % self._column(type_name), (type_name,))
+
+            self.cursor.execute('CREATE TABLE instance_names(name TEXT)')                              # Rebuild instance without the type columns
+            self.cursor.execute('INSERT INTO instance_names SELECT name FROM instance ORDER BY rowid')
+            self.cursor.execute('DROP TABLE instance')
+            self.cursor.execute('ALTER TABLE instance_names RENAME TO instance')
+            self.normalized = True
+            self.create_indexes()
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups every write made inside the with-block into one transaction, committed when the outermost batch
+        exits and rolled back if it raises. Batches nest: an inner batch that raises is rolled back to a savepoint
+        and leaves the writes of the enclosing batch in place.
+        :return: None
+        """
+        self.batch_depth += 1
+        if not self.db.in_transaction:
+            self.cursor.execute('BEGIN')                                                                # sqlite3 opens none for DDL such as ALTER TABLE
+        savepoint = None
+        if self.batch_depth > 1:
+            savepoint = 'batch_%d' % self.batch_depth
+            self.cursor.execute('SAVEPOINT %s' % savepoint)
+        try:
+            yield
+        except:
+            self.batch_depth -= 1
+            if savepoint is not None:
+                self.cursor.execute('ROLLBACK TO %s' % savepoint)
+                self.cursor.execute('RELEASE %s' % savepoint)
+            else:
+                self.db.rollback()
+            self._detect_storage()                                                                      # A rolled back migrate_to_normalized
+            self._notify('reset')
+            raise
+        self.batch_depth -= 1
+        if savepoint is not None:
+            self.cursor.execute('RELEASE %s' % savepoint)
+        else:
+            self.db.commit()
+
+    def subscribe(self, listener):
+        """
+        Calls listener(event, *args) after every write made through this object, with the name and arguments of the
+        mutator, e.g. listener('set_on', 'a', 'b'). listener('reset') means that writes it was told about were rolled
+        back, so whatever it built from them should be rebuilt.
+        :param listener: callable
+        :return: None
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def _notify(self, event, *args):
+        for listener in self.listeners:
+            listener(event, *args)
+
+    def version(self):
+        """
+        :return: a number that changes whenever another connection commits to the database, but not on this
+            object's own commits
+        """
+        self.cursor.execute('PRAGMA data_version')
+        return self.cursor.fetchone()[0]
+
+    def _commit(self):
+        if self.batch_depth == 0:
+            self.db.commit()
+
+    def _column(self, type_name):
+        """
+        Type names become column names, which cannot be passed as statement parameters, so they are checked and
+        quoted instead.
+        :param type_name: name of a type
+        :return: quoted column name
+        """
+        assert IDENTIFIER.match(type_name), 'Invalid type name: %s' % type_name
+        return '"%s"' % type_name
+
     def list_blocks(self):
         """
         :return: a list of block names
         """
-        self.cursor.execute('SELECT name FROM instance')
+        self.cursor.execute('SELECT name FROM instance ORDER BY rowid')
         instances = [f[0] for f in self.cursor.fetchall()]
 
         return instances
@@ -46,19 +302,44 @@ class Data:
         :param block_name: name of block
         :return: True if block exists, False otherwise
         """
-        self.cursor.execute('SELECT name FROM instance')
-        instances = [f[0] for f in self.cursor.fetchall()]
+        self.cursor.execute('SELECT 1 FROM instance WHERE name=? LIMIT 1', (block_name,))
+        return self.cursor.fetchone() is not None
 
-        return block_name in instances
+    def missing_blocks(self, block_names):
+        """
+        Checks many names at once, with one query per 500 names.
+        :param block_names: iterable of names
+        :return: list of the names that are not blocks, without repeats, in the order given
+        """
+        names = list(OrderedDict.fromkeys(block_names))
+        found = set()
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            self.cursor.execute('SELECT name FROM instance WHERE name IN (%s)' % ','.join('?' * len(chunk)), chunk)
+            found.update(f[0] for f in self.cursor.fetchall())
+        return [name for name in names if name not in found]
 
     def check_type(self, type_name):
         """
         :param type_name: name of type to check
         :return: True if type_name is already a type, False otherwise
         """
-        self.cursor.execute("SELECT * FROM instance")
-        types = [f[0] for f in self.cursor.description][1:]
-        return type_name in types
+        if self.normalized:
+            self.cursor.execute('SELECT 1 FROM types WHERE name=?', (type_name,))
+            return self.cursor.fetchone() is not None
+
+        return type_name in self.list_types()
+
+    def list_types(self):
+        """
+        :return: a list of type names
+        """
+        if self.normalized:
+            self.cursor.execute('SELECT name FROM types ORDER BY rowid')
+            return [f[0] for f in self.cursor.fetchall()]
+
+        self.cursor.execute('PRAGMA table_info(instance)')
+        return [f[1] for f in self.cursor.fetchall()][1:]
 
     def add_block(self, block_name):
         """
@@ -68,8 +349,30 @@ class Data:
         """
         assert not self.check_block(block_name), 'Block already exists: %s' % block_name                # If block already exists, then crash
 
-        self.cursor.execute("INSERT INTO instance(name) VALUES('%s')" % block_name)                     # Default values for everything but name
-        self.db.commit()
+        self.cursor.execute('INSERT INTO instance(name) VALUES(?)', (block_name,))                      # Default values for everything but name
+        if self.normalized:
+            self.cursor.execute("INSERT INTO membership VALUES(?, 'block')", (block_name,))
+        self._commit()
+        self._notify('add_block', block_name)
+
+    def add_blocks(self, block_names):
+        """
+        Adds every block in block_names with one executemany, in a single commit.
+        :param block_names: iterable of names of blocks to add
+        :return: None
+        """
+        block_names = list(block_names)
+        new = set(self.missing_blocks(block_names))
+        for block_name in block_names:
+            assert block_name in new, 'Block already exists: %s' % block_name                           # If block already exists, then crash
+            new.discard(block_name)
+
+        self.cursor.executemany('INSERT INTO instance(name) VALUES(?)', ((b,) for b in block_names))
+        if self.normalized:
+            self.cursor.executemany("INSERT INTO membership VALUES(?, 'block')", ((b,) for b in block_names))
+        self._commit()
+        for block_name in block_names:
+            self._notify('add_block', block_name)
 
     def add_type(self, type_name):
         """
@@ -77,15 +380,56 @@ class Data:
         :param typename:
         :return: None
         """
-        self.cursor.execute('ALTER TABLE instance ADD COLUMN %s INTEGER DEFAULT 0' % type_name)
-        self.db.commit()
+        if self.normalized:
+            self.cursor.execute('INSERT INTO types VALUES(?)', (type_name,))
+        else:
+            self.cursor.execute('ALTER TABLE instance ADD COLUMN %s INTEGER DEFAULT 0' % self._column(type_name))
+        self._commit()
+        self._notify('add_type', type_name)
 
     def list_on(self):
         self.cursor.execute('SELECT * FROM on_relation')
         return self.cursor.fetchall()
 
+    def get_on(self, block):
+        """
+        :param block: name of block
+        :return: name of the block that block is on (the oldest such fact), or None if it is not on anything
+        """
+        self.cursor.execute('SELECT bottom FROM on_relation WHERE top=? ORDER BY rowid LIMIT 1', (block,))
+        row = self.cursor.fetchone()
+        return None if row is None else row[0]
+
+    def check_on(self, block_a, block_b):
+        """
+        :param block_a: block on top
+        :param block_b: block on bottom
+        :return: True if on(block_a, block_b) holds, False otherwise
+        """
+        self.cursor.execute('SELECT 1 FROM on_relation WHERE top=? AND bottom=? LIMIT 1', (block_a, block_b))
+        return self.cursor.fetchone() is not None
+
     def remove_on(self, block):
-        pass                                                                                            #TODO implement ##############################################################
+        """
+        Removes every on relation with block on top
+        :param block: name of block
+        :return: None
+        """
+        self.cursor.execute('DELETE FROM on_relation WHERE top=?', (block,))
+        self._commit()
+        self._notify('remove_on', block)
+
+    def remove_on_many(self, blocks):
+        """
+        Removes every on relation with one of blocks on top, with one executemany, in a single commit.
+        :param blocks: iterable of names of blocks
+        :return: None
+        """
+        blocks = list(blocks)
+        self.cursor.executemany('DELETE FROM on_relation WHERE top=?', ((b,) for b in blocks))
+        self._commit()
+        for block in blocks:
+            self._notify('remove_on', block)
 
     def set_on(self, block_a, block_b):
         """
@@ -95,11 +439,27 @@ class Data:
         :return: None
         """
 
-        assert self.check_block(block_a), 'No such block: %block_a'                                     # If any argument does not correspond to an existing block, then crash
-        assert self.check_block(block_b), 'No such block: %block_b'                                     # If any argument does not correspond to an existing block, then crash
+        assert self.check_block(block_a), 'No such block: %s' % block_a                                 # If any argument does not correspond to an existing block, then crash
+        assert self.check_block(block_b), 'No such block: %s' % block_b                                 # If any argument does not correspond to an existing block, then crash
 
-        self.cursor.execute("INSERT INTO on_relation VALUES('%s', '%s')" % (block_a, block_b))
-        self.db.commit()
+        self.cursor.execute('INSERT INTO on_relation VALUES(?, ?)', (block_a, block_b))
+        self._commit()
+        self._notify('set_on', block_a, block_b)
+
+    def set_on_many(self, pairs):
+        """
+        Establishes on(a, b) for every (a, b) in pairs with one executemany, in a single commit.
+        :param pairs: iterable of (block on top, block on bottom)
+        :return: None
+        """
+        pairs = list(pairs)
+        missing = self.missing_blocks(block for pair in pairs for block in pair)
+        assert not missing, 'No such block: %s' % missing[0]                                            # If any argument does not correspond to an existing block, then crash
+
+        self.cursor.executemany('INSERT INTO on_relation VALUES(?, ?)', pairs)
+        self._commit()
+        for block_a, block_b in pairs:
+            self._notify('set_on', block_a, block_b)
 
     def check_block_type(self, block_name, type_name):
         """
@@ -111,7 +471,11 @@ class Data:
         assert self.check_type(type_name), 'No such type: %s' % type_name                               # If there is no such type type_name, then crash
         assert self.check_block(block_name), 'No such block: %s' % block_name                           # If block_name doesn't exist, then crash
 
-        self.cursor.execute("SELECT %s FROM instance WHERE name='%s'" % (type_name, block_name))
+        if self.normalized:
+            self.cursor.execute('SELECT 1 FROM membership WHERE block=? AND type=?', (block_name, type_name))
+            return self.cursor.fetchone() is not None
+
+        self.cursor.execute('SELECT %s FROM instance WHERE name=?' % self._column(type_name), (block_name,))
         return self.cursor.fetchone()[0] == 1
 
     def set_block_type(self, block_name, type_name, membership='1'):
@@ -125,9 +489,53 @@ class Data:
         assert self.check_type(type_name), 'No such type: %s' % type_name                               # If there is no such type type_name, then crash
         assert self.check_block(block_name), 'No such block: %s' % block_name                           # If block_name doesn't exist, then crash
 
-        self.cursor.execute("UPDATE instance SET %s=%s where name='%s'" %
-                            (type_name, ('1' if membership else '0'), block_name))
-        self.db.commit()
+        if self.normalized and membership:
+            self.cursor.execute('INSERT OR IGNORE INTO membership VALUES(?, ?)', (block_name, type_name))
+        elif self.normalized:
+            self.cursor.execute('DELETE FROM membership WHERE block=? AND type=?', (block_name, type_name))
+        else:
+            self.cursor.execute('UPDATE instance SET %s=? WHERE name=?' % self._column(type_name),
+                                (1 if membership else 0, block_name))
+        self._commit()
+        self._notify('set_block_type', block_name, type_name, membership)
+
+    def set_type_implication(self, type_one, type_two):
+        """
+        Makes every current block of type type_one also of type type_two, in one statement.
+        :param type_one: name of first type
+        :param type_two: name of second type
+        :return: None
+        """
+        assert self.check_type(type_one), 'No such type: %s' % type_one                                 # If either type doesn't exist, then crash
+        assert self.check_type(type_two), 'No such type: %s' % type_two
+
+        if self.normalized:
+            self.cursor.execute('INSERT OR IGNORE INTO membership SELECT block, ? FROM membership WHERE type=?',
+                                (type_two, type_one))
+        else:
+            self.cursor.execute('UPDATE instance SET %s=1 WHERE %s=1' % (self._column(type_two),
+                                                                       self._column(type_one)))
+        self._commit()
+        self._notify('set_type_implication', type_one, type_two)
+
+    def type_type_query(self, type_one, type_two):
+        """
+        Checks whether every current block of type type_one is also of type type_two, in one query.
+        :param type_one: name of first type
+        :param type_two: name of second type
+        :return: True if no block is of type_one without being of type_two, False otherwise
+        """
+        assert self.check_type(type_one), 'No such type: %s' % type_one                                 # If either type doesn't exist, then crash
+        assert self.check_type(type_two), 'No such type: %s' % type_two
+
+        if self.normalized:
+            self.cursor.execute('SELECT NOT EXISTS(SELECT 1 FROM membership m WHERE m.type=? AND NOT EXISTS('
+                                'SELECT 1 FROM membership n WHERE n.block=m.block AND n.type=?))',
+                                (type_one, type_two))
+        else:
+            self.cursor.execute('SELECT NOT EXISTS(SELECT 1 FROM instance WHERE %s=1 AND %s IS NOT 1)' %
+                                (self._column(type_one), self._column(type_two)))
+        return self.cursor.fetchone()[0] == 1
 
     def display_data(self):
         """
@@ -149,3 +557,291 @@ class Data:
 
         return toreturn
 
+
+
+def _in_memory(database):
+    return database == ':memory:' or 'mode=memory' in database
+
+
+class ConnectionPool:
+    """
+    Connections to one database, each lent to one thread at a time. Connections are opened as they are first
+    needed, up to size.
+    """
+    def __init__(self, database, size):
+        """
+        :param database: Filename or SQLite URI of the database
+        :param size: most connections open at once
+        """
+        self.database = database
+        self.size = size
+        self.opened = 0
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        connection = lite.connect(self.database, cached_statements=256, uri=self.database.startswith('file:'),
+                                  check_same_thread=False)
+        if 'cache=shared' in self.database:
+            connection.execute('PRAGMA read_uncommitted=1')                                             # Otherwise reads fail while a batch holds a table lock
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends a connection, waiting for one to come back if size are lent out already.
+        :return: sqlite3 connection
+        """
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                opening = self.opened < self.size
+                if opening:
+                    self.opened += 1
+            connection = self._connect() if opening else self.idle.get()
+        try:
+            yield connection
+        finally:
+            connection.rollback()
+            self.idle.put(connection)
+
+    def close(self):
+        """
+        Closes the connections that are not lent out.
+        :return: None
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class CachedData(Data):
+    """
+    A Data that answers reads from an in-process copy of the blocks, types, type memberships and on relation.
+    The copy is loaded on first use and kept up to date by this object's own writes. It is reloaded when another
+    connection or process commits to the database file, and after a batch rolls back.
+
+    Whether another connection has committed is checked with one PRAGMA data_version per read outside a batch, but
+    only once per outermost batch inside one: the transaction the batch holds keeps other commits from showing up
+    until it ends. WorldOperator commands run by command_runner and session_server each run in a batch.
+    """
+    def __init__(self, database, wipe=True, normalized=False, readers=0, enabled=True):
+        """
+        :param database: Filename or URI of the database
+        :param wipe: see Data
+        :param normalized: see Data
+        :param readers: see Data; readers do not use the cache
+        :param enabled: When False every read goes to the database, as with a plain Data, so the two can be compared
+        :return:
+        """
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidate()
+        Data.__init__(self, database, wipe, normalized, readers)
+
+    def invalidate(self):
+        """
+        Drops the cached copy, so the next read reloads it.
+        :return: None
+        """
+        self.data_version = None
+        self.checked = False            # data_version already compared in the current outermost batch
+        self.blocks = None              # name -> None, in insertion order
+        self.types = None               # name -> set of the names of its blocks, in insertion order
+        self.on = None                  # list of (top, bottom), in insertion order
+        self.on_top = None              # top -> list of bottoms, in insertion order
+
+    def _load(self):
+        self.data_version = self.version()
+        self.blocks = OrderedDict.fromkeys(Data.list_blocks(self))
+        self.types = OrderedDict((t, set()) for t in Data.list_types(self))
+        if self.normalized:
+            self.cursor.execute('SELECT block, type FROM membership')
+            for block_name, type_name in self.cursor.fetchall():
+                self.types[type_name].add(block_name)
+        else:
+            for type_name, members in self.types.items():
+                self.cursor.execute('SELECT name FROM instance WHERE %s=1' % self._column(type_name))
+                members.update(f[0] for f in self.cursor.fetchall())
+        self.on = []
+        self.on_top = {}
+        self.cursor.execute('SELECT top, bottom FROM on_relation ORDER BY rowid')
+        for top, bottom in self.cursor.fetchall():
+            self._add_on(top, bottom)
+        self.loads += 1
+
+    def _fresh(self):
+        """
+        :return: True if the cached copy can answer a read, loading it first if needed. False if the cache is
+            disabled.
+        """
+        if not self.enabled:
+            return False
+        if self.blocks is not None and (self.checked or self.version() == self.data_version):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._load()
+        self.checked = self.batch_depth > 0
+        return True
+
+    def _cached(self):
+        """
+        :return: True if the cached copy is loaded and should follow a write made through this object
+        """
+        return self.enabled and self.blocks is not None
+
+    def _add_on(self, top, bottom):
+        self.on.append((top, bottom))
+        self.on_top.setdefault(top, []).append(bottom)
+
+    def _drop_on(self, blocks):
+        blocks = set(blocks)
+        self.on = [f for f in self.on if f[0] not in blocks]
+        for block in blocks:
+            self.on_top.pop(block, None)
+
+    def cache_info(self):
+        """
+        :return: dict of hits, misses, loads, hit_rate and size, the number of cached facts
+        """
+        size = 0
+        if self.blocks is not None:
+            size = (len(self.blocks) + len(self.types) + len(self.on) +
+                    sum(len(members) for members in self.types.values()))
+        reads = self.hits + self.misses
+        return {'enabled': self.enabled, 'hits': self.hits, 'misses': self.misses, 'loads': self.loads,
+                'hit_rate': float(self.hits) / reads if reads else 0.0, 'size': size}
+
+    @contextmanager
+    def batch(self):
+        try:
+            with Data.batch(self):
+                yield
+        except:
+            self.invalidate()                                                                           # The cached copy has writes that were rolled back
+            raise
+        finally:
+            if self.batch_depth == 0:
+                self.checked = False
+
+    def migrate_to_normalized(self):
+        Data.migrate_to_normalized(self)
+        self.invalidate()
+
+    def restore(self, path):
+        Data.restore(self, path)
+        self.invalidate()
+
+    def list_blocks(self):
+        if not self._fresh():
+            return Data.list_blocks(self)
+        return list(self.blocks)
+
+    def check_block(self, block_name):
+        if not self._fresh():
+            return Data.check_block(self, block_name)
+        return block_name in self.blocks
+
+    def missing_blocks(self, block_names):
+        if not self._fresh():
+            return Data.missing_blocks(self, block_names)
+        return [name for name in OrderedDict.fromkeys(block_names) if name not in self.blocks]
+
+    def check_type(self, type_name):
+        if not self._fresh():
+            return Data.check_type(self, type_name)
+        return type_name in self.types
+
+    def list_types(self):
+        if not self._fresh():
+            return Data.list_types(self)
+        return list(self.types)
+
+    def list_on(self):
+        if not self._fresh():
+            return Data.list_on(self)
+        return list(self.on)
+
+    def get_on(self, block):
+        if not self._fresh():
+            return Data.get_on(self, block)
+        bottoms = self.on_top.get(block)
+        return bottoms[0] if bottoms else None
+
+    def check_on(self, block_a, block_b):
+        if not self._fresh():
+            return Data.check_on(self, block_a, block_b)
+        return block_b in self.on_top.get(block_a, ())
+
+    def check_block_type(self, block_name, type_name):
+        if not self._fresh():
+            return Data.check_block_type(self, block_name, type_name)
+        assert type_name in self.types, 'No such type: %s' % type_name                                # If there is no such type type_name, then crash
+        assert block_name in self.blocks, 'No such block: %s' % block_name                              # If block_name doesn't exist, then crash
+        return block_name in self.types[type_name]
+
+    def type_type_query(self, type_one, type_two):
+        if not self._fresh():
+            return Data.type_type_query(self, type_one, type_two)
+        assert type_one in self.types, 'No such type: %s' % type_one                                   # If either type doesn't exist, then crash
+        assert type_two in self.types, 'No such type: %s' % type_two
+        return self.types[type_one] <= self.types[type_two]
+
+    def add_block(self, block_name):
+        Data.add_block(self, block_name)
+        if self._cached():
+            self.blocks[block_name] = None
+            self.types['block'].add(block_name)
+
+    def add_blocks(self, block_names):
+        block_names = list(block_names)
+        Data.add_blocks(self, block_names)
+        if self._cached():
+            self.blocks.update((b, None) for b in block_names)
+            self.types['block'].update(block_names)
+
+    def add_type(self, type_name):
+        Data.add_type(self, type_name)
+        if self._cached():
+            self.types[type_name] = set()
+
+    def set_on(self, block_a, block_b):
+        Data.set_on(self, block_a, block_b)
+        if self._cached():
+            self._add_on(block_a, block_b)
+
+    def set_on_many(self, pairs):
+        pairs = list(pairs)
+        Data.set_on_many(self, pairs)
+        if self._cached():
+            for block_a, block_b in pairs:
+                self._add_on(block_a, block_b)
+
+    def remove_on(self, block):
+        Data.remove_on(self, block)
+        if self._cached():
+            self._drop_on([block])
+
+    def remove_on_many(self, blocks):
+        blocks = list(blocks)
+        Data.remove_on_many(self, blocks)
+        if self._cached():
+            self._drop_on(blocks)
+
+    def set_block_type(self, block_name, type_name, membership='1'):
+        Data.set_block_type(self, block_name, type_name, membership)
+        if self._cached() and membership:
+            self.types[type_name].add(block_name)
+        elif self._cached():
+            self.types[type_name].discard(block_name)
+
+    def set_type_implication(self, type_one, type_two):
+        Data.set_type_implication(self, type_one, type_two)
+        if self._cached():
+            self.types[type_two] |= self.types[type_one]
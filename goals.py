@@ -0,0 +1,134 @@
+from __future__ import print_function
+from collections import OrderedDict
+
+"""Goal handling for set_on_set.
+
+GoalQueue collects the on(a, b) pairs of several set_on_set requests into
+one combined goal, so that they can be planned with a single search, which
+usually also needs fewer moves than planning them one after another. A
+request that contradicts itself, the queued goal, or the current world
+together with the queued goal is rejected as a whole when it is queued,
+and leaves the requests queued before it in place.
+
+goal_conflicts() is the static check run before every search. A goal that
+fails it has no plan, and the planner would only find that out after
+exhausting its search space.
+"""
+
+# Places that can hold any number of blocks. Every block, and the t1 and t2
+# locations of the Baxter workspace, hold at most one.
+UNBOUNDED = ('table', 'center')
+
+
+def pair_conflicts(pairs, goal=None, below=None, unbounded=UNBOUNDED):
+    """
+    Finds the pairs that cannot hold together with each other and with goal.
+    :param pairs: list of (block on top, block on bottom)
+    :param goal: dict of top -> bottom already required
+    :param below: dict of bottom -> top already required, for bottoms other than unbounded ones
+    :param unbounded: bottoms that can hold any number of blocks
+    :return: list of strings describing each conflict, empty if there is none
+    """
+    goal = dict(goal or {})
+    below = dict(below or {})
+    conflicts = []
+    for top, bottom in pairs:
+        if top == bottom:
+            conflicts.append('%s cannot be on itself' % top)
+            continue
+        if goal.get(top, bottom) != bottom:
+            conflicts.append('%s cannot be on both %s and %s' % (top, goal[top], bottom))
+            continue
+        if bottom not in unbounded and below.get(bottom, top) != top:
+            conflicts.append('%s cannot hold both %s and %s' % (bottom, below[bottom], top))
+            continue
+        goal[top] = bottom
+        if bottom not in unbounded:
+            below[bottom] = top
+    return conflicts
+
+
+def goal_conflicts(pairs, positions, unbounded=UNBOUNDED):
+    """
+    Checks the goal that set_on_set plans for: positions with each top of pairs moved onto its bottom. Looks for
+    pairs that contradict each other, places asked to hold more than one block, and cycles such as
+    on(a,b), on(b,a). Takes O(len(positions)) time.
+    :param pairs: list of (block on top, block on bottom)
+    :param positions: dict of top -> bottom in the current world; blocks not in pairs stay where they are
+    :param unbounded: bottoms that can hold any number of blocks
+    :return: list of strings describing each conflict, empty if there is none
+    """
+    conflicts = pair_conflicts(pairs, unbounded=unbounded)
+    if conflicts:
+        return conflicts
+
+    goal = dict(positions)
+    goal.update(pairs)
+    holder = {}
+    for top, bottom in goal.items():
+        if bottom in unbounded:
+            continue
+        if bottom in holder:
+            conflicts.append('%s cannot hold both %s and %s' % (bottom, holder[bottom], top))
+        else:
+            holder[bottom] = top
+
+    visited = {}                            # block -> True while on the current path, False once finished
+    for start in goal:
+        path = []
+        block = start
+        while block in goal and block not in visited:
+            visited[block] = True
+            path.append(block)
+            block = goal[block]
+        if visited.get(block):
+            cycle = path[path.index(block):] + [block]
+            conflicts.append('%s would be stacked in a cycle' % ' on '.join(cycle))
+        for block in path:
+            visited[block] = False
+    return conflicts
+
+
+class GoalQueue():
+
+    """Pending set_on_set requests, merged into one goal."""
+
+    def __init__(self):
+        self.goal = OrderedDict()           # top -> bottom, in the order first requested
+        self.below = {}                     # bottom -> top, for bottoms other than UNBOUNDED ones
+        self.requests = []                  # pairs of each queued request, in order
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, pairs, positions=None):
+        """
+        Queues a request unless it conflicts with itself or with the queued goal, or, given positions, unless the
+        queued goal with the request added fails goal_conflicts.
+        :param pairs: list of (block on top, block on bottom)
+        :param positions: dict of top -> bottom in the current world, or None to compare only the requests
+        :return: list of conflicts; the request was queued only if it is empty
+        """
+        pairs = list(pairs)
+        conflicts = pair_conflicts(pairs, self.goal, self.below)
+        if not conflicts and positions is not None:
+            conflicts = goal_conflicts(self.pairs() + pairs, positions)
+        if conflicts:
+            return conflicts
+        for top, bottom in pairs:
+            self.goal[top] = bottom
+            if bottom not in UNBOUNDED:
+                self.below[bottom] = top
+        self.requests.append(pairs)
+        return []
+
+    def pairs(self):
+        """
+        :return: the merged goal as a list of (block on top, block on bottom)
+        """
+        return list(self.goal.items())
+
+    def clear(self):
+        self.goal.clear()
+        self.below.clear()
+        self.requests = []
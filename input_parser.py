@@ -1,3 +1,38 @@
+# Sentences are recognized by their first and last words, after one split. A rule is
+# (command, final character, number of words, position of the first argument, position of the
+# second argument or None); LEADING rules are keyed on the first word and also give the phrase
+# the sentence must start with.
+CREATE_BLOCK = ('create_block', '.', 4, 0, None)
+CREATE_TYPE = ('create_type', '.', 4, 0, None)
+WHAT_IS_ON = ('what_is_on', '?', 4, 2, None)
+SET_INSTANCE_TYPE = ('set_instance_type', '.', 3, 0, 2)
+IS_ON = ('is_on', '?', 4, 1, 3)
+INSTANCE_TYPE_QUERY = ('instance_type_query', '?', 3, 1, 2)
+TRAILING = {
+    'block.': CREATE_BLOCK,
+    'type.': CREATE_TYPE,
+}
+LEADING = {
+    'all': ('all current blocks that are', ('set_type_implication', '.', 8, 5, 7)),
+    'are': ('are all current blocks that are', ('type_type_query', '?', 8, 6, 7)),
+}
+
+
+def match(string, words, rule):
+    """
+    :param string: input, not empty
+    :param words: string.split(' '), which the final character is stripped from
+    :param rule: (command, final character, number of words, argument position, argument position or None)
+    :return: (command, arguments), or None if the sentence does not have the shape of rule
+    """
+    command, end, length, first, second = rule
+    if string[-1] != end or len(words) != length:
+        return None
+
+    words[-1] = words[-1][:-1]
+    if second is None:
+        return command, [words[first]]
+    return command, [words[first], words[second]]
 
 
 class InputParser:
@@ -23,114 +58,38 @@ class InputParser:
             return[0] is command name
             return[1] is list of argument to the command
         """
-        if len(string) >= 11 and string[-11:] == 'is a block.':
-            return self.parse_create_block(string)
-        elif len(string) >= 10 and string[-10:] == 'is a type.':
-            return self.parse_create_type(string)
-        elif len(string) >= 7 and string[:7] == 'what is':
-            return self.parse_what_is_on(string)
-        elif len(string.split(' ')) >= 2 and string.split(' ')[1] == 'is':
-            return self.parse_set_instance_type(string)
-        elif len(string) >= 19 and string[:27] == 'all current blocks that are':
-            return self.parse_set_type_implication(string)
-        elif len(string) >= 23 and string[:31] == 'are all current blocks that are':
-            return self.parse_type_type_query(string)
-        elif len(string) >= 3 and string[:3] == 'on(':
-            return self.parse_set_on_set(string)
-        elif len(string.split(' ')) == 4 and string.split(' ')[0] == 'is' and string.split(' ')[2] == 'on':
-            return self.parse_is_on(string)
-        elif len(string) >= 2 and string[:2] == 'is':
-            return self.parse_instance_type_query(string)
-        elif string == 'display data.':
-            return self.parse_display_data(string)
-        else:
-            return None
-
-    def parse_create_block(self, string):
-        """
-        For input of the form: a is a block.
-        :param string:
-        :return:
-        """
-        command = 'create_block'
-        words = string[:-1].split(' ')
-
-        if string[-1] != '.' or len(words) != 4:
-            return None
-
-        arguments = [words[0]]
-
-        return command, arguments
-
-    def parse_create_type(self, string):
-        """
-        For input of the form: blue is a type.
-        :param string:
-        :return:
-        """
-        command = 'create_type'
-        words = string[:-1].split(' ')
-
-        if string[-1] != '.' or len(words) != 4:
-            return None
-
-        arguments = [words[0]]
-
-        return command, arguments
-
-    def parse_set_instance_type(self, string):
-        """
-        For input of the form: a is blue.
-        :param string:
-        :return:
-        """
-        command = 'set_instance_type'
-        words = string[:-1].split(' ')
+        words = string.split(' ')
+        first = words[0]
 
-        if string[-1] != '.' or len(words) != 3:
-            return None
+        if len(words) >= 3 and words[-2] == 'a' and words[-3].endswith('is'):                         # ... is a block. / ... is a type.
+            rule = TRAILING.get(words[-1])
+            if rule is not None:
+                return match(string, words, rule)
 
-        arguments = [words[0], words[2]]
+        if first == 'what' and string.startswith('what is'):
+            return match(string, words, WHAT_IS_ON)
+        if len(words) >= 2 and words[1] == 'is':
+            return match(string, words, SET_INSTANCE_TYPE)
 
-        return command, arguments
+        leading = LEADING.get(first)
+        if leading is not None and string.startswith(leading[0]):
+            return match(string, words, leading[1])
 
-    def parse_set_type_implication(self, string):
-        """
-        For input of the form: all current blocks that are blue are horse.
-        :param string:
-        :return:
-        """
-        command = 'set_type_implication'
-        arguments = []
-
-        words = string[:-1].split(' ')
-
-        if string[-1] != '.' or len(words) != 8:
-            return None
-
-        arguments = [words[5], words[7]]
-
-        return command, arguments
-
-    def parse_type_type_query(self, string):
-        """
-        For input of the form: are all blocks that are mammal horse?
-        :param string:
-        :return:
-        """
-        command = 'type_type_query'
-        words = string[:-1].split(' ')
-
-        if string[-1] != '?' or len(words) != 8:
-            return None
-
-        arguments = [words[6], words[7]]
-
-        return command, arguments
+        if first.startswith('on('):
+            return self.parse_set_on_set(string)
+        if first == 'is' and len(words) == 4 and words[2] == 'on':
+            return match(string, words, IS_ON)
+        if first.startswith('is'):
+            return match(string, words, INSTANCE_TYPE_QUERY)
+        if string == 'display data.':
+            return self.parse_display_data(string)
+        return None
 
     def parse_set_on_set(self, string):
         """
         For input of the form: on(a,B), on(B,fasd).
+        Splits again, on ', ' and then ',', rather than reusing parse's split: for the usual one to four pairs these
+        C-level splits beat a single regular-expression scan of the sentence.
         :param string:
         :return:
         """
@@ -151,21 +110,6 @@ class InputParser:
 
         return command, arguments
 
-    def parse_instance_type_query(self, string):
-        """
-        For input of the form: is a blue?
-        :return:
-        """
-        command = 'instance_type_query'
-        words = string[:-1].split(' ')
-
-        if string[-1] != '?' or len(words) != 3:
-            return None
-
-        arguments = [words[1], words[2]]
-
-        return command, arguments
-
     def parse_display_data(self, string):
         """
         For input of the form: list tables.
@@ -174,79 +118,3 @@ class InputParser:
         """
 
         return 'display_data', []
-
-    def parse_what_is_on(self, string):
-        """
-        For input of the form: what is a on?
-        :param string:
-        :return:
-        """
-
-        command = 'what_is_on'
-        words = string[:-1].split(' ')
-
-        if string[-1] != '?' or len(words) != 4:
-            return None
-
-        arguments = [words[2]]
-
-        return command, arguments
-
-    def parse_is_on(self, string):
-        """
-        For input of the form: is a on b?
-        :param string:
-        :return:
-        """
-
-        command = 'is_on'
-        words = string[:-1].split(' ')
-
-        if string[-1] != '?' or len(words) != 4:
-            return None
-
-        arguments = [words[1], words[3]]
-
-        return command, arguments
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,171 @@
+from __future__ import print_function
+import bisect
+import json
+import marshal
+import timeit
+from contextlib import contextmanager
+
+"""Search instrumentation for HTNPlanner.
+
+Pass a PlannerStats to HTNPlanner(..., stats=PlannerStats()) and every
+planning run adds its counters to it. Without one the planner skips all
+bookkeeping. Results can be written as JSON, or as a marshalled profile
+that pstats reads like a cProfile dump:
+
+    stats.dump_pstats('plan.prof')
+    pstats.Stats('plan.prof').sort_stats('cumulative').print_stats()
+
+CommandStats does the same for WorldOperator commands: how often each ran
+and a histogram of how long it took.
+"""
+
+clock = timeit.default_timer
+
+# Upper bounds, in seconds, of the latency histogram buckets: 1us doubling up
+# to about 17s. Slower calls land in one overflow bucket.
+LATENCY_BUCKETS = tuple(1e-6 * 2 ** k for k in range(25))
+
+
+def _function_key(func):
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return ('~', 0, getattr(func, '__name__', repr(func)))
+    return (code.co_filename, code.co_firstlineno, func.__name__)
+
+
+class PlannerStats():
+
+    """Counters collected while the planner searches."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.nodes_expanded = 0
+        self.operator_applications = 0
+        self.operator_failures = 0
+        self.method_attempts = {}
+        self.method_failures = {}
+        self.backtracks = 0
+        self.max_depth = 0
+        self.state_copies = 0
+        self.phase_times = {}
+        self.calls = {}             # function key -> [calls, seconds]
+
+    def expanded(self, depth):
+        self.nodes_expanded += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _called(self, func, seconds):
+        entry = self.calls.get(_function_key(func))
+        if entry is None:
+            self.calls[_function_key(func)] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def operator_applied(self, operator, seconds, newstate):
+        self.operator_applications += 1
+        if not newstate:
+            self.operator_failures += 1
+        self._called(operator, seconds)
+
+    def method_called(self, method, seconds):
+        name = method.__name__
+        self.method_attempts[name] = self.method_attempts.get(name, 0) + 1
+        self._called(method, seconds)
+
+    def method_failed(self, method):
+        name = method.__name__
+        self.method_failures[name] = self.method_failures.get(name, 0) + 1
+
+    @contextmanager
+    def phase(self, name):
+        """Adds the wall time of the with-block to phase name."""
+        start = clock()
+        try:
+            yield
+        finally:
+            self.phase_times[name] = self.phase_times.get(name, 0.0) + clock() - start
+
+    def as_dict(self):
+        return {
+            'nodes_expanded': self.nodes_expanded,
+            'operator_applications': self.operator_applications,
+            'operator_failures': self.operator_failures,
+            'method_attempts': dict(self.method_attempts),
+            'method_failures': dict(self.method_failures),
+            'backtracks': self.backtracks,
+            'max_depth': self.max_depth,
+            'state_copies': self.state_copies,
+            'phase_times': dict(self.phase_times),
+            'calls': [{'file': k[0], 'line': k[1], 'function': k[2],
+                       'calls': v[0], 'seconds': v[1]} for k, v in sorted(self.calls.items())],
+        }
+
+    def to_json(self, path=None):
+        """
+        :param path: file to write to; if None the JSON text is returned
+        """
+        text = json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        if path is None:
+            return text
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def pstats_dict(self):
+        """
+        :return: the calls table in the layout pstats uses,
+            {(file, line, function): (primitive calls, calls, own time, cumulative time, callers)}
+        """
+        return dict((k, (v[0], v[0], v[1], v[1], {})) for k, v in self.calls.items())
+
+    def dump_pstats(self, path):
+        """Writes the calls table so that pstats.Stats(path) can load it."""
+        with open(path, 'wb') as f:
+            marshal.dump(self.pstats_dict(), f)
+
+
+class CommandStats():
+
+    """Call counts, total time and latency histograms per command name."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.seconds = {}
+        self.histograms = {}        # name -> counts per LATENCY_BUCKETS entry, plus overflow
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.calls[name] = 0
+            self.seconds[name] = 0.0
+        self.calls[name] += 1
+        self.seconds[name] += seconds
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def as_dict(self):
+        """
+        :return: {name: {'calls', 'seconds', 'histogram'}}, where histogram maps
+            each occupied bucket's upper bound in microseconds ('inf' for the
+            overflow bucket) to its count
+        """
+        bounds = ['%g' % (b * 1e6) for b in LATENCY_BUCKETS] + ['inf']
+        return dict((name, {'calls': self.calls[name], 'seconds': self.seconds[name],
+                            'histogram': dict((bounds[i], n) for i, n in enumerate(histogram) if n)})
+                    for name, histogram in self.histograms.items())
+
+    def to_json(self, path=None):
+        """
+        :param path: file to write to; if None the JSON text is returned
+        """
+        text = json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        if path is None:
+            return text
+        with open(path, 'w') as f:
+            f.write(text)
@@ -0,0 +1,103 @@
+from __future__ import print_function
+from collections import namedtuple
+
+"""Two-arm schedules for Baxter plans.
+
+The planner returns the steps of a Baxter plan as one sequence, although the
+left and right arms can work at the same time. schedule() orders each step
+only after the earlier steps it interferes with, and starts it as soon as
+those have finished. Two steps interfere when they
+
+- move the same block,
+- use the same arm, or
+- take from or put on the same location (t1, t2, center).
+
+Steps that share none of these change disjoint parts of the state, so running
+them in either order, or at once, reaches the same state as the plan. The
+makespan of a schedule is the time at which its last step finishes.
+
+    plan = planner.planner(state, [('move_blocks', goal)])
+    print(schedule(state, plan).format())
+"""
+
+HANDS = ('left', 'right')
+
+ScheduledStep = namedtuple('ScheduledStep', ['index', 'step', 'lane', 'start', 'finish', 'after'])
+
+
+class Schedule(list):
+
+    """ScheduledSteps in plan order, with the makespan of the schedule and of the plan run step by step."""
+
+    def __init__(self, steps=(), sequential=0):
+        list.__init__(self, steps)
+        self.makespan = max([step.finish for step in self] or [0])
+        self.sequential = sequential
+
+    def lanes(self):
+        """
+        :return: dict of lane -> ScheduledSteps run in that lane, by start time; steps that use no arm are under None
+        """
+        lanes = dict((hand, []) for hand in HANDS)
+        for step in sorted(self, key=lambda step: (step.start, step.index)):
+            lanes.setdefault(step.lane, []).append(step)
+        return lanes
+
+    def format(self):
+        """
+        :return: one line per start time with the steps each arm starts then, followed by the makespan
+        """
+        lanes = self.lanes()
+        names = list(HANDS) + [lane for lane in lanes if lane not in HANDS]
+        lines = ['Schedule:']
+        for start in sorted(set(step.start for step in self)):
+            columns = []
+            for lane in names:
+                steps = [str(step.step) for step in lanes[lane] if step.start == start]
+                columns.append('%-32s' % ', '.join(steps))
+            lines.append('%6g  %s' % (start, ' '.join(columns).rstrip()))
+        lines.append('Makespan: %g (sequential: %g)' % (self.makespan, self.sequential))
+        return '\n'.join(lines)
+
+
+def step_resources(step, positions):
+    """
+    :param step: planner step, such as ('pickup', b, hand) or ('place', b, dest, hand)
+    :param positions: dict of block -> position before step; updated to the positions after it
+    :return: set of the blocks, arms and locations that step reads or changes
+    """
+    resources = set(step[1:])
+    if step[0] == 'pickup':
+        resources.add(positions.get(step[1]))
+        positions[step[1]] = step[2]
+    elif step[0] == 'place':
+        positions[step[1]] = step[2]
+    resources.discard(None)
+    return resources
+
+
+def schedule(state, plan, durations=None, shared=()):
+    """
+    Schedules the steps of plan on the two arms, each as early as the steps it interferes with allow.
+    :param state: start state of plan, with pos[b] for every block
+    :param plan: list of steps, as returned by HTNPlanner.planner
+    :param durations: dict of action name -> duration; actions not in it take 1
+    :param shared: locations that both arms may use at the same time, such as ('center',)
+    :return: Schedule
+    """
+    durations = durations or {}
+    positions = dict(state.pos.items())
+    last = {}                               # resource -> index of the last step that used it
+    steps = []
+    sequential = 0
+    for index, step in enumerate(plan or []):
+        resources = step_resources(step, positions).difference(shared)
+        after = tuple(sorted(set(last[resource] for resource in resources if resource in last)))
+        start = max([steps[i].finish for i in after] or [0])
+        duration = durations.get(step[0], 1)
+        lane = step[-1] if step[-1] in HANDS else None
+        steps.append(ScheduledStep(index, step, lane, start, start + duration, after))
+        sequential += duration
+        for resource in resources:
+            last[resource] = index
+    return Schedule(steps, sequential)
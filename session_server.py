@@ -0,0 +1,264 @@
+from __future__ import print_function
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import sys
+
+from data import CachedData, Data
+from input_parser import InputParser
+from instrumentation import CommandStats, clock
+from settings import DATABASE
+from world_operator import WorldOperator
+
+"""Serves many concurrent command sessions over one WorldOperator.
+
+A session is a stream of sentences, one per line, over a TCP or Unix socket
+connection or stdin. Each response is written back in input order and ends
+with a blank line. Sentences are parsed in the event loop. Reads run there
+too, unless the session still has writes in flight, in which case they queue
+behind them. Every write goes through one queue to a single writer task.
+Commands that plan, such as set_on_set, search on an executor thread (see
+WorldOperator.prepare), so the loop keeps serving reads and parsing while
+the planner searches.
+
+Backpressure: when the writer queue or a session's queue of unanswered
+sentences is full, that session's reader waits, so the socket stops being
+read and the client is slowed down by the transport.
+
+The sentence 'session stats.' answers with the latency histogram and queue
+depths of the session as JSON.
+
+    python session_server.py --port 8765
+    python session_server.py --unix /tmp/world.sock --database world.db --keep
+    python session_server.py --stdio < world.txt
+
+Requires Python 3.
+"""
+
+STATS_SENTENCE = 'session stats.'
+
+
+class Session():
+
+    """One command stream and its counters."""
+
+    def __init__(self, name, depth):
+        self.name = name
+        self.responses = asyncio.Queue(depth)       # futures of responses, in input order
+        self.pending_writes = 0
+        self.commands = 0
+        self.max_queue_depth = 0
+        self.open = True
+
+
+class SessionServer():
+
+    """Runs the sentences of concurrent sessions against one WorldOperator."""
+
+    def __init__(self, operator, queue_size=256, session_depth=32, executor=None):
+        """
+        :param operator: WorldOperator shared by every session
+        :param queue_size: most commands waiting for the writer task
+        :param session_depth: most unanswered sentences per session
+        :param executor: concurrent.futures executor to plan on; defaults to one thread
+        """
+        self.operator = operator
+        self.parser = InputParser()
+        self.queue_size = queue_size
+        self.session_depth = session_depth
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(1)
+        self.latency = CommandStats()           # keyed by session name
+        self.sessions = {}
+        self.opened = 0
+        self.queue = None
+        self.writer = None
+
+    async def start(self):
+        """Starts the writer task; call from the running event loop."""
+        self.queue = asyncio.Queue(self.queue_size)
+        self.writer = asyncio.ensure_future(self._write_loop())
+
+    async def stop(self):
+        """Waits for queued commands to finish, then stops the writer task."""
+        await self.queue.join()
+        self.writer.cancel()
+        self.executor.shutdown()
+
+    def report(self, name=None):
+        """
+        :param name: session name, or None for every session
+        :return: dict with the writer queue depth and, per session, commands, latency calls, seconds and
+            histogram (see CommandStats.as_dict), max_queue_depth and pending_writes
+        """
+        latency = self.latency.as_dict()
+        sessions = {}
+        for session in self.sessions.values():
+            if name is None or session.name == name:
+                entry = dict(latency.get(session.name, {}))
+                entry.update(commands=session.commands, max_queue_depth=session.max_queue_depth,
+                             pending_writes=session.pending_writes, open=session.open)
+                sessions[session.name] = entry
+        return {'queue_depth': self.queue.qsize() if self.queue else 0, 'sessions': sessions}
+
+    async def serve_session(self, readline, write, drain, name=None):
+        """
+        Runs one session until readline returns an empty string.
+        :param readline: coroutine function returning the next line of input
+        :param write: function writing a response
+        :param drain: coroutine function waiting until written responses are sent
+        :param name: session name for the report
+        :return: None
+        """
+        self.opened += 1
+        session = Session(name or 'session-%d' % self.opened, self.session_depth)
+        self.sessions[session.name] = session
+        responder = asyncio.ensure_future(self._respond(session, write, drain))
+        try:
+            while True:
+                line = await readline()
+                if not line:
+                    break
+                sentence = line.strip()
+                if sentence:
+                    await session.responses.put(await self._submit(session, sentence))
+        finally:
+            await session.responses.put(None)
+            await responder
+            session.open = False
+
+    async def handle_connection(self, reader, writer):
+        """Callback for asyncio.start_server and start_unix_server."""
+        async def readline():
+            return (await reader.readline()).decode('utf-8')
+
+        def write(text):
+            writer.write(text.encode('utf-8'))
+
+        peer = writer.get_extra_info('peername')
+        name = '%s:%s' % peer[:2] if isinstance(peer, tuple) else None                                  # Unix sockets have no peer address
+        try:
+            await self.serve_session(readline, write, writer.drain, name)
+        finally:
+            writer.close()
+
+    async def serve_stdio(self):
+        """Runs one session over stdin and stdout."""
+        loop = asyncio.get_event_loop()
+
+        def readline():
+            return loop.run_in_executor(None, sys.stdin.readline)
+
+        async def flush():
+            sys.stdout.flush()
+
+        await self.serve_session(readline, sys.stdout.write, flush, 'stdio')
+
+    async def _submit(self, session, sentence):
+        """Returns a future of the response to sentence, queueing it for the writer if needed."""
+        future = asyncio.get_event_loop().create_future()
+        start = clock()
+        future.add_done_callback(lambda f: self.latency.record(session.name, clock() - start))
+        session.commands += 1
+
+        if sentence == STATS_SENTENCE:
+            future.set_result(json.dumps(self.report(session.name), indent=2, sort_keys=True))
+            return future
+        parsed = self.parser.parse(sentence)
+        if parsed is None:
+            future.set_result('Unrecognized sentence: %s' % sentence)
+            return future
+
+        writes = self.operator.writes(parsed[0])
+        if not writes and session.pending_writes == 0:
+            future.set_result(self._run(*parsed))
+            return future
+
+        if writes:
+            session.pending_writes += 1
+        await self.queue.put((session, parsed, writes, future))
+        session.max_queue_depth = max(session.max_queue_depth, self.queue.qsize())
+        return future
+
+    def _run(self, command, args):
+        try:
+            with self.operator.db.batch():
+                return self.operator.execute(command, args)
+        except Exception as e:
+            return 'Error: %s' % e
+
+    async def _run_queued(self, command, args):
+        operator = self.operator
+        try:
+            with operator.db.batch():
+                response, pending = operator.prepare(command, args)
+            if pending is None:
+                return response
+            plan = await asyncio.get_event_loop().run_in_executor(self.executor, operator.search, pending)
+            with operator.db.batch():
+                return operator.finish(pending, plan)
+        except Exception as e:
+            return 'Error: %s' % e
+
+    async def _write_loop(self):
+        while True:
+            session, (command, args), writes, future = await self.queue.get()
+            try:
+                response = await self._run_queued(command, args)
+            finally:
+                if writes:
+                    session.pending_writes -= 1
+                self.queue.task_done()
+            future.set_result(response)
+
+    async def _respond(self, session, write, drain):
+        while True:
+            future = await session.responses.get()
+            if future is None:
+                return
+            write('%s\n\n' % await future)
+            await drain()
+
+
+async def _serve(server, args):
+    await server.start()
+    try:
+        if args.stdio:
+            await server.serve_stdio()
+            return
+        if args.unix:
+            listener = await asyncio.start_unix_server(server.handle_connection, args.unix)
+        else:
+            listener = await asyncio.start_server(server.handle_connection, args.host, args.port)
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.stop()
+        sys.stderr.write(json.dumps(server.report(), indent=2, sort_keys=True) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve concurrent blocks-world command sessions.')
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--port', type=int, default=8765)
+    where.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    where.add_argument('--stdio', action='store_true', help='run one session over stdin and stdout')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--keep', action='store_true', help='open the existing database instead of wiping it')
+    parser.add_argument('--no-cache', action='store_true', help='read from SQLite directly instead of CachedData')
+    parser.add_argument('--queue-size', type=int, default=256, help='most commands waiting for the writer')
+    parser.add_argument('--session-depth', type=int, default=32, help='most unanswered sentences per session')
+    args = parser.parse_args(argv)
+
+    data_class = Data if args.no_cache else CachedData
+    operator = WorldOperator(data_class(args.database, wipe=not args.keep))
+    server = SessionServer(operator, args.queue_size, args.session_depth)
+    try:
+        asyncio.run(_serve(server, args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+from __future__ import print_function
+import random
+import unittest
+
+from data import CachedData, Data
+
+"""Checks that Data.set_type_implication and Data.type_type_query, which run as
+single SQL statements, answer exactly like the per-block loops over
+check_block_type and set_block_type that WorldOperator used before them.
+
+    python -m pytest test_data.py
+    python -m unittest test_data
+"""
+
+
+def loop_type_implication(db, type_one, type_two):
+    for block in db.list_blocks():
+        if db.check_block_type(block, type_one):
+            db.set_block_type(block, type_two)
+
+
+def loop_type_type_query(db, type_one, type_two):
+    for block in db.list_blocks():
+        if db.check_block_type(block, type_one) and not db.check_block_type(block, type_two):
+            return False
+    return True
+
+
+def memberships(db):
+    return set((block, type_name) for block in db.list_blocks() for type_name in db.list_types()
+               if db.check_block_type(block, type_name))
+
+
+def random_world(db, rng, blocks=30, types=6):
+    """Fills db with blocks and types, each block a member of a random subset of the types."""
+    type_names = ['type%d' % i for i in range(types)]
+    for type_name in type_names:
+        db.add_type(type_name)
+    for i in range(blocks):
+        block = 'b%d' % i
+        db.add_block(block)
+        for type_name in type_names:
+            if rng.random() < 0.3:
+                db.set_block_type(block, type_name)
+    return type_names
+
+
+class TypeSetTest(unittest.TestCase):
+
+    def check_equivalent(self, data_class, normalized, seed):
+        rng = random.Random(seed)
+        looped = data_class(':memory:', normalized=normalized)
+        batched = data_class(':memory:', normalized=normalized)
+        type_names = random_world(looped, random.Random(seed))
+        random_world(batched, random.Random(seed))
+        self.assertEqual(memberships(looped), memberships(batched))
+
+        for step in range(20):
+            for type_one in type_names:
+                for type_two in type_names:
+                    self.assertEqual(loop_type_type_query(looped, type_one, type_two),
+                                     batched.type_type_query(type_one, type_two),
+                                     'are all %s %s? (seed %d, step %d)' % (type_one, type_two, seed, step))
+            type_one, type_two = rng.choice(type_names), rng.choice(type_names)
+            loop_type_implication(looped, type_one, type_two)
+            batched.set_type_implication(type_one, type_two)
+            self.assertEqual(memberships(looped), memberships(batched))
+
+    def test_column_storage(self):
+        for seed in range(5):
+            self.check_equivalent(Data, False, seed)
+
+    def test_normalized_storage(self):
+        for seed in range(5):
+            self.check_equivalent(Data, True, seed)
+
+    def test_cached_data(self):
+        for normalized in (False, True):
+            self.check_equivalent(CachedData, normalized, 0)
+
+    def test_unknown_type(self):
+        for normalized in (False, True):
+            db = Data(':memory:', normalized=normalized)
+            db.add_type('red')
+            self.assertRaises(AssertionError, db.set_type_implication, 'red', 'blue')
+            self.assertRaises(AssertionError, db.type_type_query, 'blue', 'red')
+
+    def test_empty_type(self):
+        for normalized in (False, True):
+            db = Data(':memory:', normalized=normalized)
+            random_world(db, random.Random(0), blocks=5, types=2)
+            db.add_type('empty')
+            self.assertTrue(db.type_type_query('empty', 'type0'))
+            self.assertEqual(loop_type_type_query(db, 'type0', 'empty'), db.type_type_query('type0', 'empty'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+from __future__ import print_function
+from collections import namedtuple
+
+from HTN import HTNPlanner, UndoState
+from goals import goal_conflicts
+from instrumentation import clock
+
+"""A planning view of the world that lives as long as its Data.
+
+WorldModel keeps the start state that set_on_set plans from, and a goal
+holding the same positions, as journaled states. It subscribes to the Data
+and applies every on fact written through it as a delta, so a request does
+not rebuild either state from list_on(). A request writes its on(a, b)
+pairs into the goal, plans in place and rolls the goal back. The states are
+rebuilt from the database only on first use, after a batch rolls back, or
+when another connection has committed to the database file.
+
+execute() carries a plan out: it runs the operators on the start state,
+writes the positions that changed back to the Data in one transaction and
+rolls the state back, leaving the writes to arrive as deltas.
+"""
+
+Execution = namedtuple('Execution', ['steps', 'changes', 'seconds'])
+
+
+class ExecutionError(Exception):
+    pass
+
+
+class WorldModel():
+
+    """Start state and goal for the blocks world stored in a Data."""
+
+    def __init__(self, data, domain, **options):
+        """
+        :param data: a Data object
+        :param domain: HTN.Domain with a 'move_blocks' task
+        :param options: keyword arguments for the HTNPlanner kept by the model
+        """
+        self.db = data
+        self.planner = HTNPlanner(domain.__name__, domain, **options)
+        self.state = None
+        self.goal = None
+        self.version = None
+        self.loads = 0
+        self.deltas = 0
+        data.subscribe(self.changed)
+
+    def close(self):
+        """Stops following the Data."""
+        self.db.unsubscribe(self.changed)
+
+    def load(self):
+        """Rebuilds the start state and goal from the database."""
+        pos = {}
+        for on in self.db.list_on():
+            pos[on[0]] = on[1]
+        self.state = UndoState('Start state')
+        self.goal = UndoState('Goal state')
+        for state in (self.state, self.goal):
+            state.holding = False
+            state.pos = dict(pos)
+            state.commit()
+        self.version = self.db.version()
+        self.loads += 1
+
+    def sync(self):
+        """Makes sure the states match the database, reloading them if needed."""
+        if self.state is None or self.db.version() != self.version:
+            self.load()
+
+    def changed(self, event, *args):
+        """Data listener; only on facts affect the planning states."""
+        if self.state is None:
+            return
+        if event == 'set_on':
+            for state in (self.state, self.goal):
+                state.pos[args[0]] = args[1]
+        elif event == 'remove_on':
+            for state in (self.state, self.goal):
+                state.pos.pop(args[0], None)
+        elif event == 'reset':
+            self.state = self.goal = None
+            return
+        else:
+            return
+        self.state.commit()
+        self.goal.commit()
+        self.deltas += 1
+
+    def positions(self):
+        """
+        :return: dict-like of block -> what it is on in the current world; do not change it
+        """
+        self.sync()
+        return self.state.pos
+
+    def conflicts(self, pairs):
+        """
+        Checks pairs against the current world before planning; see goals.goal_conflicts.
+        :param pairs: list of (block on top, block on bottom)
+        :return: list of strings describing each conflict, empty if there is none
+        """
+        return goal_conflicts(pairs, self.positions())
+
+    def plan(self, pairs, sync=True):
+        """
+        Plans placing each top block on its bottom block, starting from the current world.
+        :param pairs: list of (block on top, block on bottom)
+        :param sync: Whether to check the database first. Pass False to plan on another thread than the one that
+            owns the Data connection, after calling sync() on that one.
+        :return: the plan as a Solution, or False if there is none
+        """
+        if sync:
+            self.sync()
+        goal = self.goal
+        mark = goal.checkpoint()
+        try:
+            for top, bottom in pairs:
+                goal.pos[top] = bottom
+            return self.planner.planner(self.state, [('move_blocks', goal)])
+        finally:
+            goal.rollback(mark)
+
+    def execute(self, plan):
+        """
+        Applies the effects of plan to the database. Only blocks whose position differs between the start and the
+        end of the plan are written, all in one transaction; nothing is written if any step fails.
+        :param plan: list of operator tasks, such as a Solution from plan()
+        :return: Execution(steps, changes, seconds), where steps lists (step, seconds) for every operator
+            application, changes lists the (block, new position) pairs written and seconds is the total time
+        """
+        start = clock()
+        self.sync()
+        state = self.state
+        operators = self.planner.operators
+        touched = {}
+        for step in plan:
+            for arg in step[1:]:
+                if arg in state.pos and arg not in touched:
+                    touched[arg] = state.pos[arg]
+
+        steps = []
+        mark = state.checkpoint()
+        try:
+            for step in plan:
+                step_start = clock()
+                operator = operators.get(step[0])
+                if operator is None:
+                    raise ExecutionError('Unknown operator: %s' % step[0])
+                if not operator(state, *step[1:]):
+                    raise ExecutionError('Step failed: %s' % (step,))
+                steps.append((step, clock() - step_start))
+            changes = [(block, state.pos[block]) for block in touched if state.pos[block] != touched[block]]
+        finally:
+            state.rollback(mark)
+
+        missing = set(self.db.missing_blocks(bottom for _, bottom in changes))
+        for block, bottom in changes:
+            if bottom in missing:
+                raise ExecutionError('Block %s would end up on %s, which is not a block' % (block, bottom))
+        with self.db.batch():
+            self.db.remove_on_many(block for block, _ in changes)
+            self.db.set_on_many(changes)
+        return Execution(steps, changes, clock() - start)
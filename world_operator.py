@@ -1,12 +1,78 @@
+from collections import OrderedDict, namedtuple
+
 from Blocks_World import *
+from goals import GoalQueue
+from instrumentation import CommandStats, clock
+from world_model import ExecutionError, WorldModel
+
+# The blocks-world domain is built once and shared by every set_on_set call.
+BLOCKS_WORLD = Domain("Blocks_World")
+BLOCKS_WORLD.declare_operators(pickup, unstack, putdown, stack)
+BLOCKS_WORLD.declare_methods('put', put_m)
+BLOCKS_WORLD.declare_methods('get', get_m)
+BLOCKS_WORLD.declare_methods('move_one', move1)
+BLOCKS_WORLD.declare_methods('move_blocks', moveb_m)
+
+# handler(operator, *args) runs the command. arity is the number of arguments, or a function of that number that
+# says whether it is accepted. writes marks commands that change the database. prepare, if not None, is called as
+# prepare(operator, *args) and runs the command up to its planner search, returning (response, None) if it needs
+# no search or (None, pairs) to plan; see WorldOperator.prepare.
+Command = namedtuple('Command', ['handler', 'arity', 'writes', 'prepare'])
+
+# A command stopped before its planner search by WorldOperator.prepare: the goal to plan, and when the command started.
+Pending = namedtuple('Pending', ['command', 'pairs', 'start'])
+
+COMMANDS = OrderedDict()
+
+
+def register_command(name, handler, arity, writes=False, prepare=None):
+    """
+    Makes command name available to every WorldOperator created afterwards.
+    :param name: command name, as returned by InputParser.parse
+    :param handler: function called as handler(operator, *args)
+    :param arity: number of arguments, or function of the number of arguments returning whether it is accepted
+    :param writes: whether the command changes the database
+    :param prepare: function called as prepare(operator, *args) that does what handler does up to the planner
+        search, returning (response, None) or (None, pairs); None if handler does not plan
+    :return: None
+    """
+    COMMANDS[name] = Command(handler, arity, writes, prepare)
+
+
+def even(count):
+    return count % 2 == 0
+
 
 class WorldOperator:
-    def __init__(self, data):
+    def __init__(self, data, merge_goals=False):
         """
         :param data: a Data object
+        :param merge_goals: Queue set_on_set requests instead of planning each one, and plan the merged goal in one
+            search when flush_goals() is called or before the next command that does not write
         :return: None
         """
         self.db = data
+        self.world = WorldModel(data, BLOCKS_WORLD)
+        self.last_execution = None              # world_model.Execution of the last plan carried out, with step timings
+        self.commands = OrderedDict(COMMANDS)
+        self.command_stats = CommandStats()
+        self.merge_goals = merge_goals
+        self.goals = GoalQueue()
+
+    def register(self, name, handler, arity, writes=False, prepare=None):
+        """
+        Makes command name available to this WorldOperator only; see register_command.
+        :return: None
+        """
+        self.commands[name] = Command(handler, arity, writes, prepare)
+
+    def writes(self, command):
+        """
+        :param command: command name
+        :return: True if command is known and changes the database
+        """
+        entry = self.commands.get(command)
+        return entry is not None and entry.writes
 
     def execute(self, command, args):
         """
@@ -22,33 +88,102 @@ class WorldOperator:
             -what_is_on                                 "what is a on?"
             -is_on                                      "is a on b?"
 
+        Further commands can be added with register_command or WorldOperator.register. Every call is counted and
+        timed in self.command_stats.
 
         :param command: command to execute
         :param args: arguments to that command
         :return: string indicating the result of the (attempted) execution of command over args
         """
-        if command is 'create_block' and len(args) == 1:
-            return self.create_block(args[0])
-        elif command is 'create_type' and len(args) == 1:
-            return self.create_type(args[0])
-        if command is 'set_instance_type' and len(args) == 2:
-            return self.set_instance_type(args[0], args[1])
-        elif command is 'set_type_implication' and len(args) == 2:
-            return self.set_type_implication(args[0], args[1])
-        elif command is 'instance_type_query' and len(args) == 2:
-            return self.instance_type_query(args[0], args[1])
-        elif command is 'type_type_query' and len(args) == 2:
-            return self.type_type_query(args[0], args[1])
-        elif command is 'display_data' and len(args) == 0:
-            return self.display_data()
-        elif command is 'set_on_set' and len(args) % 2 == 0:
-            return self.set_on_set(args)
-        elif command is 'what_is_on' and len(args) == 1:
-            return self.what_is_on(args[0])
-        elif command is 'is_on' and len(args) == 2:
-            return self.is_on(args[0], args[1])
-        else:
+        entry = self._entry(command, args)
+        flushed = None
+        if self.goals and not entry.writes:
+            flushed = self.flush_goals()                                                                # Reads must see the queued goals carried out
+
+        start = clock()
+        try:
+            response = entry.handler(self, *args)
+        finally:
+            self.command_stats.record(command, clock() - start)
+        return response if flushed is None else '%s\n%s' % (flushed, response)
+
+    def prepare(self, command, args):
+        """
+        Executes command like execute, except that a command registered with a prepare function stops before its
+        planner search, so that the caller can run the search elsewhere, such as on another thread:
+
+            response, pending = operator.prepare(command, args)
+            if pending is not None:
+                response = operator.finish(pending, operator.search(pending))
+
+        :param command: command to execute
+        :param args: arguments to that command
+        :return: (response, None), or (None, Pending) if the command still has to plan
+        """
+        entry = self._entry(command, args)
+        if entry.prepare is None or (self.goals and not entry.writes):
+            return self.execute(command, args), None
+
+        start = clock()
+        try:
+            response, pairs = entry.prepare(self, *args)
+        except Exception:
+            self.command_stats.record(command, clock() - start)
+            raise
+        if pairs is None:
+            self.command_stats.record(command, clock() - start)
+            return response, None
+        return None, Pending(command, pairs, start)
+
+    def search(self, pending):
+        """
+        Plans the goal of a command stopped by prepare. Reads only the world model, which prepare has synced, and
+        not the database, so it can run on any thread as long as no write happens before finish.
+        :param pending: Pending returned by prepare
+        :return: Solution, or False if no plan was found
+        """
+        return self.world.plan(pending.pairs, sync=False)
+
+    def finish(self, pending, plan):
+        """
+        Carries out the plan found for a command stopped by prepare.
+        :param pending: Pending returned by prepare
+        :param plan: result of search(pending)
+        :return: the response of the command
+        """
+        try:
+            return self.execute_plan(plan)
+        finally:
+            self.command_stats.record(pending.command, clock() - pending.start)
+
+    def _entry(self, command, args):
+        entry = self.commands.get(command)
+        if entry is None or not (entry.arity(len(args)) if callable(entry.arity) else len(args) == entry.arity):
             raise Exception('Unrecognized command: %s with %s arguments' % (command, str(len(args))))
+        return entry
+
+    def flush_goals(self):
+        """
+        Plans every queued set_on_set request in one search and carries the plan out. set_on_set checked each
+        request against the world when it was queued; one that no longer fits the world is dropped with a
+        "Dropped on(a,b): ..." line, and the others are still planned.
+        :return: String in the forms set_on_set returns, or None if nothing was queued
+        """
+        if not self.goals:
+            return None
+        requests = self.goals.requests
+        self.goals.clear()
+        positions = self.world.positions()
+        lines = []
+        for pairs in requests:
+            conflicts = self.goals.add(pairs, positions)
+            if conflicts:
+                lines.append('Dropped %s: %s' % (', '.join('on(%s,%s)' % pair for pair in pairs), '; '.join(conflicts)))
+        pairs = self.goals.pairs()
+        self.goals.clear()
+        if pairs:
+            lines.append(self.reject_goal(pairs) or self.execute_plan(self.world.plan(pairs, sync=False)))
+        return '\n'.join(lines)
 
     def create_block(self, block_name):
         """
@@ -118,9 +253,7 @@ class WorldOperator:
         elif not self.db.check_type(type_two):
             return 'No such type: %s' % type_two
         else:
-            for block in self.db.list_blocks():
-                if self.db.check_block_type(block, type_one):
-                    self.db.set_block_type(block, type_two)
+            self.db.set_type_implication(type_one, type_two)
         return 'OK, all blocks that are %s are now %s' % (type_one, type_two)
 
     def instance_type_query(self, block, type):
@@ -163,10 +296,9 @@ class WorldOperator:
             return 'No such type: %s' % type_one
         elif not self.db.check_type(type_two):
             return 'No such type: %s' % type_two
+        elif not self.db.type_type_query(type_one, type_two):
+            return 'No, not all blocks that are %s are %s' % (type_one, type_two)
         else:
-            for block in self.db.list_blocks():
-                if self.db.check_block_type(block, type_one) and not self.db.check_block_type(block, type_two):
-                    return 'No, not all blocks that are %s are %s' % (type_one, type_two)
             return 'Yes, all blocks that are %s are %s' % (type_one, type_two)
 
     def display_data(self):
@@ -195,37 +327,75 @@ class WorldOperator:
             "
 
             "Plan cannot be formulated"
-        """
 
-        sstate = State('Start state')
-        gstate = State('Goal state')
+            "No such block: d"
 
-        sstate.holding = False
-        gstate.holding = False
+            "Plan cannot be formulated: a on b on a would be stacked in a cycle"
 
-        sstate.pos = {}
-        gstate.pos = {}
+            With merge_goals the request is only queued, and the answer is one of
+            "OK, queued on(a,b), on(b,c)"
+            "Conflicting goals: b cannot hold both a and c"
+            "Conflicting goals: b on a on b would be stacked in a cycle"    (with the world, where a is on b)
+        """
+        response, pairs = self.prepare_set_on_set(args)
+        if pairs is None:
+            return response
+        return self.execute_plan(self.world.plan(pairs, sync=False))
 
-        for on in self.db.list_on():
-            sstate.pos[on[0]] = on[1]
-            gstate.pos[on[0]] = on[1]
+    def prepare_set_on_set(self, args):
+        """
+        Does everything set_on_set does before the planner search: checks the goal, or queues it with merge_goals.
+        :param args: as for set_on_set
+        :return: (response, None) if set_on_set is answered without planning, or (None, pairs) if the goal in
+            pairs is to be planned, from the world model this call has synced
+        """
+        pairs = [(args[i], args[i+1]) for i in range(0, len(args), 2)]
+        if self.merge_goals:
+            missing = self.db.missing_blocks(args)
+            if missing:
+                return 'No such block: %s' % missing[0], None
+            conflicts = self.goals.add(pairs, self.world.positions())
+            if conflicts:
+                return 'Conflicting goals: %s' % '; '.join(conflicts), None
+            return 'OK, queued %s' % ', '.join('on(%s,%s)' % pair for pair in pairs), None
+        rejection = self.reject_goal(pairs)
+        if rejection:
+            return rejection, None
+        return None, pairs
 
-        for i in range(0, len(args), 2):
-            gstate.pos[args[i]] = args[i+1]
+    def reject_goal(self, pairs):
+        """
+        Checks a goal without searching: every block must exist, and goals.goal_conflicts must find nothing.
+        :param pairs: list of (block on top, block on bottom)
+        :return: the answer to set_on_set if the goal cannot be planned, None otherwise
+        """
+        missing = self.db.missing_blocks(block for pair in pairs for block in pair)
+        if missing:
+            return 'No such block: %s' % missing[0]
+        conflicts = self.world.conflicts(pairs)
+        if conflicts:
+            return 'Plan cannot be formulated: %s' % '; '.join(conflicts)
+        return None
 
-        HTNplanner = HTNPlanner("Blocks_World")
-        HTNplanner.declare_operators(pickup, unstack, putdown, stack)
-        HTNplanner.declare_methods('put', put_m)
-        HTNplanner.declare_methods('get', get_m)
-        HTNplanner.declare_methods('move_one', move1)
-        HTNplanner.declare_methods('move_blocks', moveb_m)
-        HTNplanner.planner(sstate, [('move_blocks', gstate)])
-        plan = [p for p in HTNplanner.planningsteps.items() if p[1][0] == 'operator']
-        print("HTN Actions:")
+    def execute_plan(self, plan):
+        """
+        Carries out a plan made by self.world.plan.
+        :param plan: Solution, or False if no plan was found
+        :return: String listing the plan and whether it was executed, in the forms set_on_set returns
+        """
+        if plan is False:
+            return 'Plan cannot be formulated'
+        lines = ['HTN Actions:']
         for cnt, elem in enumerate(plan):
-            print("%s.  %s " % (cnt + 1, elem[1][1]))
+            lines.append('%s.  %s' % (cnt + 1, elem))
 
-        return 'TODO: EXECUTE PLAN'     ####################################################### TODO: execute plan
+        try:
+            self.last_execution = self.world.execute(plan)
+        except ExecutionError as e:
+            lines.append('Plan cannot be executed: %s' % e)
+        else:
+            lines.append('Actions executed.')
+        return '\n'.join(lines)
 
     def what_is_on(self, block):
         """
@@ -241,9 +411,9 @@ class WorldOperator:
         if not self.db.check_block(block):
             return 'No such block: %s' % block
 
-        for on in self.db.list_on():
-            if on[0] == block:
-                return 'Block %s is on block %s' % (block, on[1])
+        bottom = self.db.get_on(block)
+        if bottom is not None:
+            return 'Block %s is on block %s' % (block, bottom)
 
         return 'Block %s is not on anything' % block
 
@@ -268,9 +438,27 @@ class WorldOperator:
         if not self.db.check_block(block_b):
             return 'No such block: %s' % block_b
 
-        for on in self.db.list_on():
-            if on[0] == block_a and on[1] == block_b:
-                return 'Yes, block %s is on block %s' % (block_a, block_b)
+        if self.db.check_on(block_a, block_b):
+            return 'Yes, block %s is on block %s' % (block_a, block_b)
 
         return 'No, block %s is not on block %s' % (block_a, block_b)
 
+
+def _set_on_set(operator, *args):
+    return operator.set_on_set(list(args))
+
+
+def _prepare_set_on_set(operator, *args):
+    return operator.prepare_set_on_set(list(args))
+
+
+register_command('create_block', WorldOperator.create_block, 1, writes=True)
+register_command('create_type', WorldOperator.create_type, 1, writes=True)
+register_command('set_instance_type', WorldOperator.set_instance_type, 2, writes=True)
+register_command('set_type_implication', WorldOperator.set_type_implication, 2, writes=True)
+register_command('instance_type_query', WorldOperator.instance_type_query, 2)
+register_command('type_type_query', WorldOperator.type_type_query, 2)
+register_command('display_data', WorldOperator.display_data, 0)
+register_command('set_on_set', _set_on_set, even, writes=True, prepare=_prepare_set_on_set)
+register_command('what_is_on', WorldOperator.what_is_on, 1)
+register_command('is_on', WorldOperator.is_on, 2)